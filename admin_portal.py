@@ -1,6 +1,14 @@
+from itertools import islice
+
 import streamlit as st
 
-from security_utils import ensure_password_fields, hash_password
+from program_catalog import all_programmes, programme_category
+from security_utils import hash_password_record, hashing_executor, password_policy
+from session_tokens import begin_session
+from transaction_browser import SORTABLE_COLUMNS
+
+USER_PAGE_SIZE = 25
+BOOK_PAGE_SIZE = 25
 
 __all__ = [
     "admin_login_page",
@@ -69,6 +77,7 @@ def admin_login_page():
                         st.session_state.logged_in = True
                         st.session_state.user = user
                         st.session_state.role = "admin"
+                        begin_session("admin", user)
                         st.success(f"✅ Welcome, Administrator {user['name']}!")
                         st.rerun()
                     else:
@@ -108,14 +117,11 @@ def admin_dashboard():
     # Statistics with enhanced cards
     col1, col2, col3, col4 = st.columns(4)
 
-    total_users = len(st.session_state.app.users.get("students", [])) + len(
-        st.session_state.app.users.get("teachers", [])
-    )
-    total_books = len(st.session_state.app.books["student_books"]) + len(
-        st.session_state.app.books["teacher_books"]
-    )
-    active_borrows = len([t for t in st.session_state.app.transactions if t["status"] == "borrowed"])
-    total_fines = sum(t["fine"] for t in st.session_state.app.transactions)
+    stats = st.session_state.app.library_stats()
+    total_users = stats.users["students"] + stats.users["teachers"]
+    total_books = stats.total_titles
+    active_borrows = stats.statuses["borrowed"]
+    total_fines = stats.fines
 
     with col1:
         st.markdown(
@@ -169,6 +175,55 @@ def admin_dashboard():
             unsafe_allow_html=True,
         )
 
+    st.caption(
+        f"📚 {stats.titles['program']} programme titles across {len(+stats.programme_titles)} programmes • "
+        f"{stats.titles['teacher']} teacher titles • {stats.titles['collection']} collection items • "
+        f"{stats.statuses['returned']} returns"
+    )
+    timings = st.session_state.app.migration_timings
+    st.caption(
+        "🛠️ Startup migrations: "
+        + (
+            " • ".join(f"{name} {elapsed * 1000:.1f} ms" for name, elapsed in timings)
+            if timings
+            else "none pending at the last load"
+        )
+    )
+    bulk = st.session_state.app.bulk_hashing
+    if bulk:
+        st.caption(f"🔑 Startup password hashing: {bulk[0]}/{bulk[1]} accounts hashed")
+    cache = st.session_state.app.fragment_cache.stats()
+    st.caption(
+        f"🧩 Card cache: {cache['hits']} hits • {cache['misses']} misses • "
+        f"{cache['hit_rate']:.0%} hit rate • {cache['size']}/{cache['maxsize']} fragments"
+    )
+    hashing = hashing_executor.stats()
+    algorithm, iterations = password_policy()
+    st.caption(
+        f"🔐 Password hashing: PBKDF2-{algorithm.upper()} × {iterations:,} • "
+        f"{hashing['queue_depth']}/{hashing['max_pending']} in flight • "
+        f"{hashing['workers']} worker process(es) • {hashing['submitted']} hashed, {hashing['inline']} inline"
+    )
+    outbox = st.session_state.app.outbox
+    emails = outbox.counts()
+    st.caption(
+        f"📧 Email outbox: {emails.get('queued', 0)} queued • {emails.get('sent', 0)} sent • "
+        f"{emails.get('dead', 0)} undeliverable"
+    )
+    if emails.get("dead"):
+        with st.expander(f"⚠️ Undeliverable emails ({emails['dead']})"):
+            for letter in outbox.dead_letters():
+                col_info, col_retry = st.columns([4, 1])
+                with col_info:
+                    st.markdown(
+                        f"**{letter['recipient']}** • reservation {letter['reference']} • "
+                        f"{letter['attempts']} attempts  \n`{letter['last_error']}`"
+                    )
+                with col_retry:
+                    if st.button("🔁 Retry", key=f"retry_email_{letter['id']}", use_container_width=True):
+                        outbox.retry_dead(letter["id"])
+                        st.rerun()
+
     st.divider()
 
     # Tabs
@@ -184,8 +239,9 @@ def admin_dashboard():
         view_all_transactions()
 
 
+@st.fragment
 def manage_books_admin():
-    """Admin book management"""
+    """Admin book management; paging reruns only this fragment."""
     st.markdown("### 📚 Book Management")
 
     # Add new book
@@ -198,6 +254,11 @@ def manage_books_admin():
         with col2:
             copies = st.number_input("Copies", min_value=1, value=1, key="new_book_copies")
             category = st.selectbox("Category", ["Student", "Teacher"], key="new_book_cat")
+            programme = (
+                st.selectbox("Programme", ["General Library"] + all_programmes(), key="new_book_programme")
+                if category == "Student"
+                else None
+            )
 
         if st.button("💾 Add Book"):
             if all([book_id, title, author]):
@@ -208,61 +269,73 @@ def manage_books_admin():
                     "copies": copies,
                     "available": copies,
                 }
+                if programme:
+                    new_book["programme"] = programme
+                    new_book["program_category"] = programme_category(programme) or "General"
+                    new_book["catalog_type"] = "program"
+                else:
+                    new_book["catalog_type"] = "teacher"
 
-                book_list = (
-                    st.session_state.app.books["student_books"]
-                    if category == "Student"
-                    else st.session_state.app.books["teacher_books"]
-                )
-                book_list.append(new_book)
-                st.session_state.app.save_data()
-                st.success("✅ Book added successfully!")
-                st.rerun()
+                if st.session_state.app.add_book(new_book):
+                    st.success("✅ Book added successfully!")
+                    st.rerun()
+                else:
+                    st.error("❌ A book with this ID already exists in that catalogue!")
             else:
                 st.error("❌ All fields required!")
 
-    # List all books
+    # List the catalogue one page at a time
     st.markdown("### 📖 All Books")
-    all_books = st.session_state.app.books["student_books"] + st.session_state.app.books["teacher_books"]
-
-    for book in all_books:
-        with st.container():
-            col1, col2, col3 = st.columns([3, 2, 1])
-
-            with col1:
-                st.write(f"**{book['title']}** by {book['author']}")
-                st.caption(f"ID: {book['id']}")
-
-            with col2:
-                st.write(f"Available: {book['available']}/{book['copies']}")
-
-            with col3:
-                if st.button("🗑️", key=f"del_book_{book['id']}"):
-                    # Check if borrowed
-                    active = [
-                        t
-                        for t in st.session_state.app.transactions
-                        if t["book_id"] == book["id"] and t["status"] == "borrowed"
-                    ]
-                    if active:
-                        st.error("Cannot delete - book is borrowed!")
-                    else:
-                        # Remove book
-                        st.session_state.app.books["student_books"] = [
-                            b for b in st.session_state.app.books["student_books"] if b["id"] != book["id"]
-                        ]
-                        st.session_state.app.books["teacher_books"] = [
-                            b for b in st.session_state.app.books["teacher_books"] if b["id"] != book["id"]
-                        ]
-                        st.session_state.app.save_data()
-                        st.success("✅ Book deleted!")
-                        st.rerun()
+    app = st.session_state.app
+    total = len(app.book_index)
+    if not total:
+        st.info("No books in the catalogue")
+        return
+
+    pages = max((total + BOOK_PAGE_SIZE - 1) // BOOK_PAGE_SIZE, 1)
+    if st.session_state.get("book_admin_page", 1) > pages:
+        st.session_state.book_admin_page = pages
+    page = st.number_input("Page", min_value=1, max_value=pages, step=1, key="book_admin_page") - 1
+    first = page * BOOK_PAGE_SIZE
+    with app.lock:
+        # Other sessions add and remove books under the same lock.
+        rows = list(islice(app.book_index.items(), first, first + BOOK_PAGE_SIZE))
+    st.caption(f"Showing {first + 1}–{first + len(rows)} of {total}")
+    st.divider()
 
-            st.divider()
+    for location, book in rows:
+        render_book_row(location, book)
+        st.divider()
+
+
+def render_book_row(location, book: dict):
+    """Title, availability and delete control for one catalogue entry."""
+    catalog, name = location
+    col1, col2, col3 = st.columns([3, 2, 1])
+
+    with col1:
+        st.write(f"**{book['title']}** by {book['author']}")
+        st.caption(f"ID: {book['id']} • {name or catalog.title()}")
+
+    with col2:
+        st.write(f"Available: {book['available']}/{book['copies']}")
+
+    with col3:
+        if st.button("🗑️", key=f"del_book_{catalog}_{name}_{book['id']}"):
+            # Check if borrowed
+            active = st.session_state.app.transaction_index.active_for_book(book["id"], location)
+            if active:
+                st.error("Cannot delete - book is borrowed!")
+            else:
+                # Remove book
+                st.session_state.app.remove_book(book["id"], location)
+                st.success("✅ Book deleted!")
+                st.rerun()
 
 
+@st.fragment
 def manage_users_admin():
-    """Admin user management"""
+    """Admin user management; searching and paging rerun only this fragment."""
     st.markdown("### 👥 User Management")
 
     # Add new user section
@@ -282,163 +355,229 @@ def manage_users_admin():
             if all([new_name, new_username, new_password, new_id]):
                 # Check for duplicates
                 role_key = "students" if new_role == "Student" else "teachers"
-                existing = any(
-                    u["username"] == new_username or u["id"] == new_id
-                    for role in ["students", "teachers"]
-                    for u in st.session_state.app.users.get(role, [])
-                )
+                directory = st.session_state.app.user_directory
+                existing = directory.username_taken(new_username) or directory.id_taken(new_id.upper())
 
                 if existing:
                     st.error("❌ Username or ID already exists!")
                 else:
-                    password_hash, password_salt = hash_password(new_password)
                     new_user = {
                         "id": new_id.upper(),
                         "name": new_name,
                         "username": new_username,
-                        "password_hash": password_hash,
-                        "password_salt": password_salt,
+                        **hash_password_record(new_password),
                         "contact": new_contact,
                         "email": new_email,
                     }
-                    st.session_state.app.users[role_key].append(new_user)
-                    st.session_state.app.save_data()
-                    st.success(f"✅ User {new_name} added successfully!")
-                    st.rerun()
+                    if st.session_state.app.add_user(role_key, new_user):
+                        st.success(f"✅ User {new_name} added successfully!")
+                        st.rerun()
+                    else:
+                        st.error("❌ Username or ID already exists!")
             else:
                 st.error("❌ Name, Username, Password, and ID are required!")
 
     st.divider()
 
-    # List all users with edit/delete
-    all_users = []
-    for role in ["students", "teachers"]:
-        for user in st.session_state.app.users.get(role, []):
-            all_users.append({**user, "role": role})
+    # List one page of users with edit/delete
+    app = st.session_state.app
+    students = len(app.users.get("students", []))
+    teachers = len(app.users.get("teachers", []))
+    if not students + teachers:
+        st.info("No users found")
+        return
+
+    st.markdown(f"**Total Users:** {students + teachers} (Students: {students}, Teachers: {teachers})")
+    query = st.text_input("🔍 Search by name, username, ID or email", key="user_search")
+    keys = app.user_search.search_keys(query) if query.strip() else None
+    total = len(keys) if keys is not None else students + teachers
+    if not total:
+        st.info("No users match your search")
+        return
+
+    pages = max((total + USER_PAGE_SIZE - 1) // USER_PAGE_SIZE, 1)
+    if st.session_state.get("user_page", 1) > pages:
+        st.session_state.user_page = pages
+    page = st.number_input("Page", min_value=1, max_value=pages, step=1, key="user_page") - 1
+    first = page * USER_PAGE_SIZE
+    if keys is None:
+        rows = user_page(app.users, first, first + USER_PAGE_SIZE)
+    else:
+        rows = [
+            (role_key, app.user_directory.by_id(user_id, (role_key,)))
+            for role_key, user_id in keys[first:first + USER_PAGE_SIZE]
+        ]
+    st.caption(f"Showing {first + 1}–{first + len(rows)} of {total}")
+    st.divider()
 
-    if all_users:
-        st.markdown(
-            f"**Total Users:** {len(all_users)} (Students: {len(st.session_state.app.users.get('students', []))}, Teachers: {len(st.session_state.app.users.get('teachers', []))})"
-        )
-        st.divider()
+    for role_key, user in rows:
+        if user is not None:
+            render_user_row(role_key, user)
+            st.divider()
 
-        # Display users in dark cards
-        for idx, user in enumerate(all_users):
-            st.markdown(
-                f"""
-                <div style='background: #1e1e1e; padding: 1rem; border-radius: 10px; 
-                            margin: 0.5rem 0; border-left: 4px solid #6C0345;
-                            box-shadow: 0 2px 4px rgba(0,0,0,0.3);'>
-                    <p style='color: #ffffff; margin: 0; font-weight: 600; font-size: 1.1rem;'>👤 {user['name']}</p>
-                    <p style='color: #b0b0b0; margin: 0.3rem 0 0 0; font-size: 0.9rem;'>
-                        🆔 {user['id']} | 👨‍💼 {user['role'].title()} | 📧 {user.get('email', 'N/A')} | 📱 {user.get('contact', 'N/A')}
-                    </p>
-                </div>
-            """,
-                unsafe_allow_html=True,
-            )
 
-            col1, col2, col3 = st.columns([1, 1, 3])
-            with col1:
-                if st.button("✏️ Edit", key=f"edit_user_{idx}", use_container_width=True):
-                    st.session_state[f"editing_user_{idx}"] = True
-                    st.rerun()
-            with col2:
-                if st.button("🗑️ Delete", key=f"delete_user_{idx}", use_container_width=True):
-                    # Check for active borrows
-                    active_borrows = [
-                        t
-                        for t in st.session_state.app.transactions
-                        if t["user_id"] == user["id"] and t["status"] == "borrowed"
-                    ]
-                    if active_borrows:
-                        st.error(
-                            f"❌ Cannot delete! {user['name']} has {len(active_borrows)} active borrow(s)"
-                        )
-                    else:
-                        st.session_state.app.users[user["role"]] = [
-                            u for u in st.session_state.app.users[user["role"]] if u["id"] != user["id"]
-                        ]
-                        st.session_state.app.save_data()
-                        st.success(f"✅ User {user['name']} deleted!")
-                        st.rerun()
+def user_page(users: dict, start: int, stop: int) -> list[tuple[str, dict]]:
+    """Slice ``[start, stop)`` of the students followed by the teachers, without copying either list."""
+    rows = []
+    for role_key in ("students", "teachers"):
+        accounts = users.get(role_key, [])
+        rows.extend((role_key, user) for user in accounts[start:stop])
+        start = max(start - len(accounts), 0)
+        stop = max(stop - len(accounts), 0)
+    return rows
 
-            # Edit form
-            if st.session_state.get(f"editing_user_{idx}", False):
-                with st.expander(f"✏️ Edit {user['name']}", expanded=True):
-                    col_a, col_b = st.columns(2)
-                    with col_a:
-                        edit_name = st.text_input(
-                            "Name", value=user["name"], key=f"edit_name_{idx}"
-                        )
-                        edit_username = st.text_input(
-                            "Username", value=user["username"], key=f"edit_username_{idx}"
-                        )
-                        edit_password = st.text_input(
-                            "Password",
-                            type="password",
-                            key=f"edit_password_{idx}",
-                        )
-                    with col_b:
-                        edit_contact = st.text_input(
-                            "Contact", value=user.get("contact", ""), key=f"edit_contact_{idx}"
-                        )
-                        edit_email = st.text_input(
-                            "Email", value=user.get("email", ""), key=f"edit_email_{idx}"
-                        )
-
-                    col_save, col_cancel = st.columns(2)
-                    with col_save:
-                        if st.button("💾 Save Changes", key=f"save_{idx}", use_container_width=True):
-                            # Update user
-                            for u in st.session_state.app.users[user["role"]]:
-                                if u["id"] == user["id"]:
-                                    u["name"] = edit_name
-                                    u["username"] = edit_username
-                                    if edit_password:
-                                        password_hash, password_salt = hash_password(edit_password)
-                                        u["password_hash"] = password_hash
-                                        u["password_salt"] = password_salt
-                                    ensure_password_fields(u)
-                                    u["contact"] = edit_contact
-                                    u["email"] = edit_email
-                                    break
-                            st.session_state.app.save_data()
-                            st.session_state[f"editing_user_{idx}"] = False
-                            st.success("✅ User updated successfully!")
-                            st.rerun()
-                    with col_cancel:
-                        if st.button("❌ Cancel", key=f"cancel_{idx}", use_container_width=True):
-                            st.session_state[f"editing_user_{idx}"] = False
-                            st.rerun()
 
-            st.divider()
-    else:
-        st.info("No users found")
+def render_user_row(role_key: str, user: dict):
+    """Card, edit and delete controls for one account; widget keys use the user's ID."""
+    key = f"{role_key}_{user['id']}"
+    st.markdown(
+        f"""
+        <div style='background: #1e1e1e; padding: 1rem; border-radius: 10px; 
+                    margin: 0.5rem 0; border-left: 4px solid #6C0345;
+                    box-shadow: 0 2px 4px rgba(0,0,0,0.3);'>
+            <p style='color: #ffffff; margin: 0; font-weight: 600; font-size: 1.1rem;'>👤 {user['name']}</p>
+            <p style='color: #b0b0b0; margin: 0.3rem 0 0 0; font-size: 0.9rem;'>
+                🆔 {user['id']} | 👨‍💼 {role_key.title()} | 📧 {user.get('email', 'N/A')} | 📱 {user.get('contact', 'N/A')}
+            </p>
+        </div>
+    """,
+        unsafe_allow_html=True,
+    )
+
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        if st.button("✏️ Edit", key=f"edit_user_{key}", use_container_width=True):
+            st.session_state[f"editing_user_{key}"] = True
+            st.rerun()
+    with col2:
+        if st.button("🗑️ Delete", key=f"delete_user_{key}", use_container_width=True):
+            # Check for active borrows
+            active_borrows = st.session_state.app.transaction_index.active_for_user(user["id"])
+            if active_borrows:
+                st.error(
+                    f"❌ Cannot delete! {user['name']} has {len(active_borrows)} active borrow(s)"
+                )
+            else:
+                st.session_state.app.remove_user(role_key, user["id"])
+                st.session_state.pop(f"editing_user_{key}", None)
+                st.success(f"✅ User {user['name']} deleted!")
+                st.rerun()
+
+    # Edit form
+    if st.session_state.get(f"editing_user_{key}", False):
+        with st.expander(f"✏️ Edit {user['name']}", expanded=True):
+            col_a, col_b = st.columns(2)
+            with col_a:
+                edit_name = st.text_input(
+                    "Name", value=user["name"], key=f"edit_name_{key}"
+                )
+                edit_username = st.text_input(
+                    "Username", value=user["username"], key=f"edit_username_{key}"
+                )
+                edit_password = st.text_input(
+                    "Password",
+                    type="password",
+                    key=f"edit_password_{key}",
+                )
+            with col_b:
+                edit_contact = st.text_input(
+                    "Contact", value=user.get("contact", ""), key=f"edit_contact_{key}"
+                )
+                edit_email = st.text_input(
+                    "Email", value=user.get("email", ""), key=f"edit_email_{key}"
+                )
+
+            col_save, col_cancel = st.columns(2)
+            with col_save:
+                if st.button("💾 Save Changes", key=f"save_{key}", use_container_width=True):
+                    # Update user
+                    changes = {
+                        "name": edit_name,
+                        "username": edit_username,
+                        "contact": edit_contact,
+                        "email": edit_email,
+                    }
+                    if edit_password:
+                        changes.update(hash_password_record(edit_password))
+                    if st.session_state.app.update_user(role_key, user["id"], changes):
+                        if edit_password:
+                            # A reset password signs the account out everywhere.
+                            st.session_state.app.session_tokens.revoke_user(role_key, user["id"])
+                        st.session_state[f"editing_user_{key}"] = False
+                        st.success("✅ User updated successfully!")
+                        st.rerun()
+                    else:
+                        st.error("❌ Username already exists!")
+            with col_cancel:
+                if st.button("❌ Cancel", key=f"cancel_{key}", use_container_width=True):
+                    st.session_state[f"editing_user_{key}"] = False
+                    st.rerun()
 
 
+@st.fragment
 def view_all_transactions():
-    """View all transactions"""
+    """Filterable, paged transaction browser; filter changes rerun only this fragment."""
     st.markdown("### 📈 All Transactions")
 
-    if st.session_state.app.transactions:
-        # Display transactions in dark cards
-        for trans in st.session_state.app.transactions:
-            status_color = "#28a745" if trans["status"] == "returned" else "#ffc107"
-            st.markdown(
-                f"""
-                <div style='background: #1e1e1e; padding: 1rem; border-radius: 10px; 
-                            margin: 0.5rem 0; border-left: 4px solid {status_color};
-                            box-shadow: 0 2px 4px rgba(0,0,0,0.3);'>
-                    <p style='color: #ffffff; margin: 0; font-weight: 600;'>{trans['user_name']} - {trans['book_title']}</p>
-                    <p style='color: #b0b0b0; margin: 0.3rem 0 0 0; font-size: 0.85rem;'>
-                        📅 Borrowed: {trans['borrow_date']} | Due: {trans['due_date']} | 
-                        Status: <span style='color: {status_color};'>{trans['status'].title()}</span>
-                    </p>
-                    {f"<p style='color: #dc3545; margin: 0.3rem 0 0 0; font-weight: 600;'>💰 Fine: ₹{trans['fine']}</p>" if trans['fine'] > 0 else ""}
-                </div>
-            """,
-                unsafe_allow_html=True,
-            )
-    else:
+    if not st.session_state.app.transactions:
         st.info("No transactions yet")
+        return
+
+    browser = st.session_state.app.transaction_frame
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        status = st.selectbox(
+            "Status",
+            [None, "borrowed", "returned"],
+            format_func=lambda value: "All" if value is None else value.title(),
+            key="tx_status",
+        )
+        overdue = st.checkbox("Overdue only", key="tx_overdue")
+    with col2:
+        dates = st.date_input("Borrowed between", value=(), key="tx_dates")
+        user = st.text_input("User name or ID", key="tx_user")
+    with col3:
+        programme = st.selectbox(
+            "Programme / collection",
+            [None] + browser.programmes(),
+            format_func=lambda value: "All" if value is None else value,
+            key="tx_programme",
+        )
+        sort_by = st.selectbox(
+            "Sort by",
+            SORTABLE_COLUMNS,
+            format_func=lambda column: column.replace("_", " ").title(),
+            key="tx_sort",
+        )
+        ascending = st.toggle("Ascending", key="tx_ascending")
+
+    start = dates[0] if len(dates) > 0 else None
+    end = dates[1] if len(dates) > 1 else None
+    filters = dict(
+        status=status, start=start, end=end, user=user, programme=programme, overdue=overdue,
+        sort_by=sort_by, ascending=ascending,
+    )
+
+    page_size = 25
+    matches = browser.matches(**filters)
+    total = len(matches)
+    pages = max((total + page_size - 1) // page_size, 1)
+    # Narrower filters can leave the remembered page past the end.
+    if st.session_state.get("tx_page", 1) > pages:
+        st.session_state.tx_page = pages
+    page = st.number_input("Page", min_value=1, max_value=pages, step=1, key="tx_page") - 1
+    rows = matches.iloc[page * page_size:(page + 1) * page_size]
+
+    st.caption(f"{total} matching transaction(s) • page {page + 1} of {pages}")
+    st.dataframe(
+        rows,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "borrow_date": st.column_config.DateColumn("Borrowed"),
+            "due_date": st.column_config.DateColumn("Due"),
+            "return_date": st.column_config.DateColumn("Returned"),
+            "fine": st.column_config.NumberColumn("Fine (₹)"),
+        },
+    )
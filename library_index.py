@@ -0,0 +1,325 @@
+"""In-memory indexes over the BookFlow catalogue."""
+
+from __future__ import annotations
+
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Iterator
+
+from storage import iter_book_rows
+
+# (catalog, name): ('program', programme), ('teacher', '') or ('collection', collection name).
+BookLocation = tuple[str, str]
+
+TEACHER_LOCATION: BookLocation = ('teacher', '')
+
+
+def book_location(book: dict) -> BookLocation:
+    """Work out which catalogue list a book record belongs to."""
+    catalog = book.get('catalog_type')
+    if catalog == 'collection':
+        return 'collection', book.get('collection') or ''
+    if catalog == 'teacher':
+        return TEACHER_LOCATION
+    return 'program', book.get('programme') or ''
+
+
+def book_key(book: dict) -> str:
+    """Identifier that is unique across catalogues, e.g. for widget keys."""
+    catalog, name = book_location(book)
+    return f"{catalog}:{name}:{book['id']}"
+
+
+def transaction_location(trans: dict) -> BookLocation | None:
+    """Location recorded on a transaction, or None for legacy records."""
+    if trans.get('book_programme'):
+        return 'program', trans['book_programme']
+    if trans.get('book_collection'):
+        return 'collection', trans['book_collection']
+    return None
+
+
+class BookIndex:
+    """Maps every book id to its record and catalogue location.
+
+    Generated programme ids are not globally unique (two programmes can share
+    a slug), so each id keeps one entry per location.
+    """
+
+    def __init__(self):
+        self._by_id: dict[str, dict[BookLocation, dict]] = {}
+
+    def rebuild(self, books: dict) -> None:
+        self._by_id = {}
+        for catalog, name, book in iter_book_rows(books):
+            self.add(book, (catalog, name))
+
+    def add(self, book: dict, location: BookLocation) -> None:
+        self._by_id.setdefault(book['id'], {})[location] = book
+
+    def remove(self, book_id: str, location: BookLocation) -> dict | None:
+        entries = self._by_id.get(book_id)
+        if not entries:
+            return None
+        book = entries.pop(location, None)
+        if not entries:
+            del self._by_id[book_id]
+        return book
+
+    def get(self, book_id: str, location: BookLocation | None = None) -> dict | None:
+        """Return the record for ``book_id``.
+
+        Without a location the id must be unambiguous, except that teacher
+        books win because legacy teacher transactions carry no location.
+        """
+        entries = self._by_id.get(book_id)
+        if not entries:
+            return None
+        if location is not None:
+            return entries.get(location)
+        if len(entries) == 1:
+            return next(iter(entries.values()))
+        return entries.get(TEACHER_LOCATION)
+
+    def locations(self, book_id: str) -> list[BookLocation]:
+        return list(self._by_id.get(book_id, {}))
+
+    def items(self) -> Iterator[tuple[BookLocation, dict]]:
+        for entries in self._by_id.values():
+            yield from entries.items()
+
+    def __contains__(self, book_id: str) -> bool:
+        return book_id in self._by_id
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._by_id.values())
+
+
+class TransactionIndex:
+    """Secondary indexes over the transaction log.
+
+    Lists per user and per book keep log order; active (borrowed) entries are
+    additionally kept by transaction id so open loans never need a scan.
+    """
+
+    def __init__(self):
+        self._by_user: dict[str, list[dict]] = {}
+        self._by_book: dict[str, list[dict]] = {}
+        self._active_by_user: dict[str, dict[int, dict]] = {}
+        self._active_by_book: dict[str, dict[int, dict]] = {}
+
+    def rebuild(self, transactions: list[dict]) -> None:
+        self._by_user = {}
+        self._by_book = {}
+        self._active_by_user = {}
+        self._active_by_book = {}
+        for trans in transactions:
+            self.add(trans)
+
+    def add(self, trans: dict) -> None:
+        self._by_user.setdefault(trans['user_id'], []).append(trans)
+        self._by_book.setdefault(trans['book_id'], []).append(trans)
+        if trans.get('status') == 'borrowed':
+            self._active_by_user.setdefault(trans['user_id'], {})[trans['id']] = trans
+            self._active_by_book.setdefault(trans['book_id'], {})[trans['id']] = trans
+
+    def mark_returned(self, trans: dict) -> None:
+        """Drop a transaction from the active indexes after its status changed."""
+        for index, key in ((self._active_by_user, trans['user_id']), (self._active_by_book, trans['book_id'])):
+            entries = index.get(key)
+            if entries is None:
+                continue
+            entries.pop(trans['id'], None)
+            if not entries:
+                del index[key]
+
+    def for_user(self, user_id: str) -> list[dict]:
+        return list(self._by_user.get(user_id, ()))
+
+    def for_book(self, book_id: str) -> list[dict]:
+        return list(self._by_book.get(book_id, ()))
+
+    def active_for_user(self, user_id: str) -> list[dict]:
+        return list(self._active_by_user.get(user_id, {}).values())
+
+    def active_for_book(self, book_id: str, location: BookLocation | None = None) -> list[dict]:
+        """Open loans of ``book_id``; with a location, loans of that copy only.
+
+        Legacy transactions carry no location and match any copy of the id.
+        """
+        active = self._active_by_book.get(book_id, {}).values()
+        if location is None:
+            return list(active)
+        return [t for t in active if transaction_location(t) in (None, location)]
+
+    def active_count(self) -> int:
+        return sum(len(entries) for entries in self._active_by_user.values())
+
+
+class UserDirectory:
+    """Accounts of every role keyed by lower-cased username and by id.
+
+    Usernames and ids are only unique within a role, so each key maps to the
+    matching account per role key ('students', 'teachers', 'admin').
+    """
+
+    def __init__(self):
+        self._by_username: dict[str, dict[str, dict]] = {}
+        self._by_id: dict[str, dict[str, dict]] = {}
+
+    def rebuild(self, users: dict) -> None:
+        self._by_username = {}
+        self._by_id = {}
+        for role_key, accounts in users.items():
+            for user in accounts:
+                self.add(role_key, user)
+
+    def add(self, role_key: str, user: dict) -> None:
+        self._by_username.setdefault(user['username'].lower(), {})[role_key] = user
+        self._by_id.setdefault(user['id'], {})[role_key] = user
+
+    def remove(self, role_key: str, user: dict) -> None:
+        for index, key in ((self._by_username, user['username'].lower()), (self._by_id, user['id'])):
+            entries = index.get(key)
+            if entries is None:
+                continue
+            entries.pop(role_key, None)
+            if not entries:
+                del index[key]
+
+    def by_username(self, username: str, role_key: str) -> dict | None:
+        """Case-insensitive lookup; callers that need an exact match compare afterwards."""
+        return self._by_username.get(username.lower(), {}).get(role_key)
+
+    def by_id(self, user_id: str, role_keys=('students', 'teachers')) -> dict | None:
+        entries = self._by_id.get(user_id, {})
+        for role_key in role_keys:
+            if role_key in entries:
+                return entries[role_key]
+        return None
+
+    def username_taken(self, username: str, role_keys=('students', 'teachers')) -> bool:
+        entries = self._by_username.get(username.lower(), {})
+        return any(role_key in entries for role_key in role_keys)
+
+    def id_taken(self, user_id: str, role_keys=('students', 'teachers')) -> bool:
+        return self.by_id(user_id, role_keys) is not None
+
+
+def latest_sort_key(book: dict) -> tuple[int, str]:
+    """Dated books (added through the admin portal) rank above seeded ones."""
+    if book.get('added_at'):
+        return 1, book['added_at']
+    return 0, book.get('title_signature', '')
+
+
+class LatestBooks:
+    """Programme books kept ordered by ``latest_sort_key``.
+
+    Inserts and removals are a bisect plus a list shift, so the carousel can
+    read its top K slides without re-sorting the programme on every rerun.
+    """
+
+    def __init__(self):
+        self._ordered: dict[str, list[tuple[tuple[int, str], int, dict]]] = {}
+        self._seq = 0
+
+    def rebuild(self, program_books: dict) -> None:
+        self._ordered = {}
+        for programme, books in program_books.items():
+            for book in books:
+                self.add(programme, book)
+
+    def add(self, programme: str, book: dict) -> None:
+        # Ties keep catalogue order, and the counter means dicts are never compared.
+        self._seq += 1
+        insort(self._ordered.setdefault(programme, []), (latest_sort_key(book), -self._seq, book))
+
+    def remove(self, programme: str, book: dict) -> None:
+        entries = self._ordered.get(programme, [])
+        start = bisect_left(entries, (latest_sort_key(book),))
+        for i in range(start, len(entries)):
+            if entries[i][2] is book:
+                del entries[i]
+                return
+
+    def top(self, programme: str, limit: int) -> list[dict]:
+        entries = self._ordered.get(programme, [])
+        return [book for _, _, book in reversed(entries[-limit:])] if limit > 0 else []
+
+
+class LibraryStats:
+    """Dashboard aggregates kept as counters instead of recomputed per visit.
+
+    Mutating code paths report their events; ``recount`` rebuilds everything
+    from the raw data and reports any counter that had drifted.
+    """
+
+    def __init__(self):
+        self.users: Counter = Counter()
+        self.titles: Counter = Counter()
+        self.programme_titles: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.fines = 0
+        self.last_recount = 0.0
+
+    def recount(self, users: dict, books: dict, transactions: list[dict]) -> dict[str, tuple]:
+        """Rebuild from scratch; returns ``{name: (maintained, recounted)}`` for drifted counters."""
+        before = self.snapshot()
+        self.users = Counter({role_key: len(accounts) for role_key, accounts in users.items()})
+        self.titles = Counter()
+        self.programme_titles = Counter()
+        for catalog, name, _ in iter_book_rows(books):
+            self.book_added((catalog, name))
+        self.statuses = Counter(t.get('status') for t in transactions)
+        self.fines = sum(t.get('fine', 0) for t in transactions)
+        self.last_recount = time.monotonic()
+        after = self.snapshot()
+        if not before:
+            return {}
+        # A counter that drifted to zero is absent from ``after``, so compare over both.
+        return {
+            name: (before.get(name, 0), after.get(name, 0))
+            for name in sorted(before.keys() | after.keys())
+            if before.get(name, 0) != after.get(name, 0)
+        }
+
+    def snapshot(self) -> dict:
+        flat = {f'users.{k}': v for k, v in self.users.items()}
+        flat.update({f'titles.{k}': v for k, v in self.titles.items()})
+        flat.update({f'programme.{k}': v for k, v in self.programme_titles.items()})
+        flat.update({f'status.{k}': v for k, v in self.statuses.items()})
+        if self.fines:
+            flat['fines'] = self.fines
+        return {name: value for name, value in flat.items() if value}
+
+    def user_added(self, role_key: str) -> None:
+        self.users[role_key] += 1
+
+    def user_removed(self, role_key: str) -> None:
+        self.users[role_key] -= 1
+
+    def book_added(self, location: BookLocation) -> None:
+        catalog, name = location
+        self.titles[catalog] += 1
+        if catalog == 'program':
+            self.programme_titles[name] += 1
+
+    def book_removed(self, location: BookLocation) -> None:
+        catalog, name = location
+        self.titles[catalog] -= 1
+        if catalog == 'program':
+            self.programme_titles[name] -= 1
+
+    def borrowed(self) -> None:
+        self.statuses['borrowed'] += 1
+
+    def returned(self, fine: int) -> None:
+        self.statuses['borrowed'] -= 1
+        self.statuses['returned'] += 1
+        self.fines += fine
+
+    @property
+    def total_titles(self) -> int:
+        return sum(self.titles.values())
@@ -0,0 +1,389 @@
+"""Durable outbox for notification emails, delivered by a background worker."""
+
+from __future__ import annotations
+
+import email
+import email.policy
+import logging
+import os
+import smtplib
+import socketserver
+import sqlite3
+import ssl
+import threading
+import time
+from email.message import EmailMessage
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('BOOKFLOW_OUTBOX_MAX_ATTEMPTS', '5'))
+# First retry delay; each further failure doubles it.
+OUTBOX_BACKOFF_SECONDS = float(os.getenv('BOOKFLOW_OUTBOX_BACKOFF_SECONDS', '30'))
+OUTBOX_MAX_BACKOFF_SECONDS = 3600.0
+# Upper bound on how long the worker sleeps when nothing is due.
+OUTBOX_POLL_SECONDS = 5.0
+
+_OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    reference TEXT,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_reference ON outbox (reference);
+"""
+
+Sender = Callable[[EmailMessage], tuple[bool, str | None]]
+
+
+def email_setting(name: str) -> str | None:
+    value = os.getenv(name)
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+class UndeliverableError(Exception):
+    """Raised by a sender for a failure that retrying cannot fix, such as missing settings."""
+
+
+def smtp_config_error(message: EmailMessage | None = None) -> str | None:
+    """Why the ``BOOKFLOW_SMTP_*`` settings cannot send mail, or None when they look usable."""
+    if message is not None:
+        from_address = message["From"]
+    else:
+        from_address = email_setting("BOOKFLOW_EMAIL_SENDER") or email_setting("BOOKFLOW_SMTP_USERNAME")
+    required = [
+        email_setting("BOOKFLOW_SMTP_SERVER"),
+        email_setting("BOOKFLOW_SMTP_USERNAME"),
+        email_setting("BOOKFLOW_SMTP_PASSWORD"),
+        from_address,
+    ]
+    if not all(required):
+        return (
+            "SMTP settings are incomplete. Set BOOKFLOW_SMTP_SERVER, BOOKFLOW_SMTP_PORT, "
+            "BOOKFLOW_SMTP_USERNAME, BOOKFLOW_SMTP_PASSWORD, and BOOKFLOW_EMAIL_SENDER."
+        )
+    smtp_port = email_setting("BOOKFLOW_SMTP_PORT") or "465"
+    if not smtp_port.isdigit():
+        return f"Invalid SMTP port: {smtp_port}"
+    return None
+
+
+def send_via_smtp(message: EmailMessage) -> tuple[bool, str | None]:
+    """Deliver one message with the ``BOOKFLOW_SMTP_*`` settings; returns (sent, error).
+
+    ``BOOKFLOW_SMTP_SECURITY`` is ``ssl``, ``starttls`` or ``none``; by default
+    port 465 uses SSL and any other port STARTTLS. Settings that cannot work
+    raise ``UndeliverableError`` instead of returning a retryable error.
+    """
+    problem = smtp_config_error(message)
+    if problem:
+        raise UndeliverableError(problem)
+    smtp_server = email_setting("BOOKFLOW_SMTP_SERVER")
+    port = int(email_setting("BOOKFLOW_SMTP_PORT") or "465")
+    smtp_username = email_setting("BOOKFLOW_SMTP_USERNAME")
+    smtp_password = email_setting("BOOKFLOW_SMTP_PASSWORD")
+    security = (email_setting("BOOKFLOW_SMTP_SECURITY") or ("ssl" if port == 465 else "starttls")).lower()
+
+    try:
+        context = ssl.create_default_context()
+        if security == "ssl":
+            with smtplib.SMTP_SSL(smtp_server, port, context=context, timeout=20) as server:
+                server.login(smtp_username, smtp_password)
+                server.send_message(message)
+        else:
+            with smtplib.SMTP(smtp_server, port, timeout=20) as server:
+                server.ehlo()
+                if security == "starttls":
+                    server.starttls(context=context)
+                    server.ehlo()
+                server.login(smtp_username, smtp_password)
+                server.send_message(message)
+        return True, None
+    except smtplib.SMTPAuthenticationError as exc:
+        detail = None
+        if getattr(exc, "smtp_error", None):
+            try:
+                detail = exc.smtp_error.decode("utf-8", errors="ignore")
+            except AttributeError:
+                detail = str(exc.smtp_error)
+        return False, (
+            f"Authentication failed: {detail.strip()}" if detail else "Authentication failed: check username/app password."
+        )
+    except smtplib.SMTPConnectError as exc:
+        return False, f"Connection error: {exc.smtp_error.decode() if getattr(exc, 'smtp_error', None) else exc}"
+    except Exception as exc:  # pragma: no cover - depends on external SMTP
+        return False, str(exc)
+
+
+class EmailOutbox:
+    """SQLite-backed queue of outgoing messages.
+
+    ``enqueue`` only writes a row, so request handlers never wait on a mail
+    server. A worker thread sends due messages; a failed attempt is retried
+    after an exponentially growing delay, and a message that fails
+    ``max_attempts`` times is parked with status ``dead`` (the dead-letter
+    list) instead of being retried forever. A sender raising
+    ``UndeliverableError`` sends the message there on the first attempt.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        sender: Sender = send_via_smtp,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        backoff: float = OUTBOX_BACKOFF_SECONDS,
+    ):
+        self.db_path = db_path
+        self.sender = sender
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        # The worker and every session thread share this connection under _lock.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_OUTBOX_SCHEMA)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._worker: threading.Thread | None = None
+
+    def enqueue(self, message: EmailMessage, reference: str | None = None) -> int:
+        """Durably queue ``message``; ``reference`` ties it to e.g. a reservation id."""
+        now = time.time()
+        with self._lock, self._conn as conn:
+            cursor = conn.execute(
+                'INSERT INTO outbox (reference, recipient, message, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)',
+                (reference, message["To"], message.as_string(), now, now),
+            )
+        self._wake.set()
+        return cursor.lastrowid
+
+    def status(self, reference: str) -> dict | None:
+        """Delivery state of the latest message queued under ``reference``."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, attempts, last_error, next_attempt_at, sent_at FROM outbox '
+                'WHERE reference = ? ORDER BY id DESC LIMIT 1',
+                (reference,),
+            ).fetchone()
+        if row is None:
+            return None
+        status, attempts, last_error, next_attempt_at, sent_at = row
+        return {
+            'status': status,
+            'attempts': attempts,
+            'last_error': last_error,
+            'next_attempt_at': next_attempt_at,
+            'sent_at': sent_at,
+        }
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status'))
+
+    def dead_letters(self, limit: int = 50) -> list[dict]:
+        """Messages that exhausted their attempts, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, reference, recipient, attempts, last_error, created_at FROM outbox "
+                "WHERE status = 'dead' ORDER BY id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        columns = ('id', 'reference', 'recipient', 'attempts', 'last_error', 'created_at')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def retry_dead(self, message_id: int) -> None:
+        """Put a dead letter back in the queue with a fresh attempt budget."""
+        with self._lock, self._conn as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'queued', attempts = 0, next_attempt_at = ? WHERE id = ? AND status = 'dead'",
+                (time.time(), message_id),
+            )
+        self._wake.set()
+
+    def deliver_due(self, limit: int = 20) -> int:
+        """Attempt every message whose retry time has come; returns how many were tried."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, message, attempts FROM outbox WHERE status = 'queued' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        for message_id, raw, attempts in rows:
+            message = email.message_from_string(raw, policy=email.policy.default)
+            permanent = False
+            try:
+                sent, error = self.sender(message)
+            except UndeliverableError as exc:
+                sent, error, permanent = False, str(exc), True
+            except Exception as exc:
+                sent, error = False, str(exc)
+            self._record_attempt(message_id, attempts + 1, sent, error, permanent)
+        return len(rows)
+
+    def _record_attempt(
+        self, message_id: int, attempts: int, sent: bool, error: str | None, permanent: bool = False
+    ) -> None:
+        now = time.time()
+        with self._lock, self._conn as conn:
+            if sent:
+                conn.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = ?, last_error = NULL, sent_at = ? WHERE id = ?",
+                    (attempts, now, message_id),
+                )
+            elif permanent or attempts >= self.max_attempts:
+                conn.execute(
+                    "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, error, message_id),
+                )
+                logger.warning("Email %s moved to the dead-letter list after %d attempts: %s", message_id, attempts, error)
+            else:
+                delay = min(self.backoff * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+                conn.execute(
+                    "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                    (attempts, error, now + delay, message_id),
+                )
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'queued'").fetchone()
+        if row[0] is None:
+            return OUTBOX_POLL_SECONDS
+        return min(max(row[0] - time.time(), 0.0), OUTBOX_POLL_SECONDS)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.deliver_due()
+                wait = self._next_due_in()
+            except Exception:  # pragma: no cover - keep the worker alive
+                logger.exception("Outbox delivery pass failed")
+                wait = OUTBOX_POLL_SECONDS
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name='bookflow-outbox', daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def close(self) -> None:
+        self.stop()
+        with self._lock:
+            self._conn.close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(f'{line}\r\n'.encode('utf-8'))
+
+    def handle(self) -> None:
+        self.reply('220 bookflow-local ESMTP')
+        sender, recipients, auth_step = None, [], None
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            if auth_step:
+                # AUTH LOGIN sends the username and password on their own lines.
+                auth_step -= 1
+                self.reply('334 UGFzc3dvcmQ6' if auth_step else '235 Authentication successful')
+                continue
+            verb = line.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-bookflow-local\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif verb == 'HELO':
+                self.reply('250 bookflow-local')
+            elif verb == 'AUTH':
+                mechanism = line.split(' ')[1].upper() if ' ' in line else ''
+                if mechanism == 'LOGIN':
+                    auth_step = 2
+                    self.reply('334 VXNlcm5hbWU6')
+                else:
+                    self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                sender, recipients = line.split(':', 1)[1].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(line.split(':', 1)[1].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data[1:] if data.startswith(b'..') else data)
+                message = email.message_from_bytes(b''.join(lines), policy=email.policy.default)
+                self.server.messages.append({'from': sender, 'to': recipients, 'message': message})
+                self.reply('250 OK: queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """Plain-text SMTP stand-in that accepts any login and keeps what it receives.
+
+    For local runs and tests: point ``BOOKFLOW_SMTP_SERVER``/``PORT`` at it and
+    set ``BOOKFLOW_SMTP_SECURITY=none``. Received mail is in ``messages``.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), _SMTPHandler)
+        self.messages: list[dict] = []
+        self._thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> 'LocalSMTPServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='bookflow-local-smtp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    server = LocalSMTPServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 1025).start()
+    print(f"Local SMTP stand-in listening on 127.0.0.1:{server.port}; Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+            while server.messages:
+                received = server.messages.pop(0)
+                print(f"--- {received['from']} -> {', '.join(received['to'])}\n{received['message']}")
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,367 @@
+"""Full-text search over the BookFlow catalogue and user accounts."""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+from library_index import BookLocation
+
+SEARCH_FIELDS = ('title', 'author', 'programme', 'collection', 'format')
+FUZZY_FIELDS = ('title', 'author')
+USER_SEARCH_FIELDS = ('name', 'username', 'id', 'email')
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+')
+
+# (catalog, name, book id): book ids are only unique within a location.
+DocKey = tuple[str, str, str]
+# (role key, user id): ids are only unique within a role.
+UserKey = tuple[str, str]
+
+
+def tokenize(text) -> list[str]:
+    return _TOKEN_RE.findall(str(text).lower()) if text else []
+
+
+def book_facet(book: dict, location: BookLocation) -> tuple[str, str]:
+    """Facet a catalogue entry is counted under: ('category', ...) or ('collection', ...)."""
+    catalog, name = location
+    if catalog == 'collection':
+        return 'collection', name
+    if catalog == 'teacher':
+        return 'category', 'Teacher Books'
+    return 'category', book.get('program_category') or 'General'
+
+
+class SearchIndex:
+    """Inverted index from tokens to the books whose fields contain them.
+
+    Each posting stores a bitmask of the fields the token occurs in, so a
+    query can rank results by how many distinct fields it matched. Every
+    query term is treated as a prefix and all terms must match (AND).
+
+    Sessions search while others add or remove books, so reads and writes
+    both hold the index lock; the postings are never iterated mid-update.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings: dict[str, dict[DocKey, int]] = {}
+        self._vocabulary: list[str] = []
+        self._docs: dict[DocKey, dict] = {}
+        self._doc_tokens: dict[DocKey, set[str]] = {}
+        self._doc_facets: dict[DocKey, tuple[str, str]] = {}
+        self._facet_totals: Counter = Counter()
+
+    def rebuild(self, rows) -> None:
+        """Index ``(catalog, name, book)`` rows, e.g. from ``iter_book_rows``."""
+        with self._lock:
+            self._postings = {}
+            self._docs = {}
+            self._doc_tokens = {}
+            self._doc_facets = {}
+            self._facet_totals = Counter()
+            for catalog, name, book in rows:
+                self._index(book, (catalog, name))
+            self._vocabulary = sorted(self._postings)
+
+    def add(self, book: dict, location: BookLocation) -> None:
+        with self._lock:
+            for token in self._index(book, location):
+                insort(self._vocabulary, token)
+
+    def remove(self, book_id: str, location: BookLocation) -> None:
+        with self._lock:
+            key = (*location, book_id)
+            self._docs.pop(key, None)
+            facet = self._doc_facets.pop(key, None)
+            if facet is not None:
+                self._facet_totals[facet] -= 1
+                if not self._facet_totals[facet]:
+                    del self._facet_totals[facet]
+            for token in self._doc_tokens.pop(key, ()):
+                postings = self._postings[token]
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[token]
+                    del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _index(self, book: dict, location: BookLocation) -> list[str]:
+        """Add one book's postings and return the tokens new to the vocabulary."""
+        key = (*location, book['id'])
+        self._docs[key] = book
+        facet = self._doc_facets[key] = book_facet(book, location)
+        self._facet_totals[facet] += 1
+        masks: dict[str, int] = {}
+        for bit, field in enumerate(SEARCH_FIELDS):
+            for token in tokenize(book.get(field)):
+                masks[token] = masks.get(token, 0) | (1 << bit)
+        self._doc_tokens[key] = set(masks)
+        new_tokens = []
+        for token, mask in masks.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                new_tokens.append(token)
+            postings[key] = mask
+        return new_tokens
+
+    def _expand(self, prefix: str) -> dict[DocKey, int]:
+        """Union of the postings of every token starting with ``prefix``."""
+        exact = self._postings.get(prefix)
+        start = bisect_left(self._vocabulary, prefix)
+        if exact is not None:
+            start += 1
+        matched = dict(exact) if exact else {}
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            for key, mask in self._postings[token].items():
+                matched[key] = matched.get(key, 0) | mask
+        return matched
+
+    def search(self, query: str, location: BookLocation | None = None) -> list[dict]:
+        """Books matching every term of ``query``, best field coverage first."""
+        with self._lock:
+            return [self._docs[key] for key in self.search_keys(query, location)]
+
+    def search_keys(self, query: str, location: BookLocation | None = None) -> list[DocKey]:
+        with self._lock:
+            terms = sorted(set(tokenize(query)), key=len, reverse=True)
+            if not terms:
+                return []
+            # Longest terms first: they usually have the fewest postings.
+            matched = self._expand(terms[0])
+            if location is not None:
+                matched = {key: mask for key, mask in matched.items() if key[:2] == location}
+            for term in terms[1:]:
+                if not matched:
+                    break
+                postings = self._expand(term)
+                matched = {key: mask | postings[key] for key, mask in matched.items() if key in postings}
+            ranked = sorted(matched.items(), key=lambda item: -bin(item[1]).count('1'))
+            return [key for key, _ in ranked]
+
+    def get(self, key: DocKey) -> dict | None:
+        return self._docs.get(key)
+
+    def facet(self, key: DocKey) -> tuple[str, str] | None:
+        return self._doc_facets.get(key)
+
+    def facet_counts(self, keys=None) -> Counter:
+        """Per-facet counts for ``keys``, or for the whole catalogue when omitted."""
+        with self._lock:
+            if keys is None:
+                return Counter(self._facet_totals)
+            return Counter(self._doc_facets[key] for key in keys if key in self._doc_facets)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+
+def trigrams(word: str) -> set[str]:
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Typo-tolerant matching of title and author words.
+
+    Trigrams index the distinct words, and each word points at the books
+    that use it, so a misspelt term is compared against the vocabulary
+    rather than every book. Lookups stop scoring once their time budget
+    is spent and rank what they have seen so far. Reads and writes hold
+    the index lock, as in ``SearchIndex``.
+    """
+
+    def __init__(self, threshold: float = 0.45):
+        self._lock = threading.RLock()
+        self.threshold = threshold
+        self._grams: dict[str, set[str]] = {}
+        self._words: dict[str, set[DocKey]] = {}
+        self._docs: dict[DocKey, dict] = {}
+
+    def rebuild(self, rows) -> None:
+        with self._lock:
+            self._grams = {}
+            self._words = {}
+            self._docs = {}
+            for catalog, name, book in rows:
+                self.add(book, (catalog, name))
+
+    def add(self, book: dict, location: BookLocation) -> None:
+        with self._lock:
+            key = (*location, book['id'])
+            self._docs[key] = book
+            for word in self._doc_words(book):
+                docs = self._words.get(word)
+                if docs is None:
+                    docs = self._words[word] = set()
+                    for gram in trigrams(word):
+                        self._grams.setdefault(gram, set()).add(word)
+                docs.add(key)
+
+    def remove(self, book_id: str, location: BookLocation) -> None:
+        with self._lock:
+            key = (*location, book_id)
+            book = self._docs.pop(key, None)
+            if book is None:
+                return
+            for word in self._doc_words(book):
+                docs = self._words.get(word)
+                if docs is None:
+                    continue
+                docs.discard(key)
+                if docs:
+                    continue
+                del self._words[word]
+                for gram in trigrams(word):
+                    words = self._grams.get(gram)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self._grams[gram]
+
+    @staticmethod
+    def _doc_words(book: dict) -> set[str]:
+        # Very short words carry too few trigrams to match fuzzily.
+        return {w for field in FUZZY_FIELDS for w in tokenize(book.get(field)) if len(w) > 2}
+
+    def similar_words(self, term: str, deadline: float | None = None) -> dict[str, float]:
+        """Vocabulary words whose Dice trigram similarity to ``term`` clears the threshold."""
+        grams = trigrams(term)
+        overlap: dict[str, int] = {}
+        for gram in grams:
+            for word in self._grams.get(gram, ()):
+                overlap[word] = overlap.get(word, 0) + 1
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        similar = {}
+        for word, shared in overlap.items():
+            score = 2 * shared / (len(grams) + len(word) + 1)
+            if score >= self.threshold:
+                similar[word] = score
+        return similar
+
+    def search(
+        self,
+        query: str,
+        location: BookLocation | None = None,
+        limit: int = 20,
+        budget: float = 0.05,
+    ) -> list[dict]:
+        """Books ranked by average best-word similarity across the query terms.
+
+        ``budget`` is the time in seconds after which scoring stops early.
+        """
+        with self._lock:
+            return [self._docs[key] for key in self.search_keys(query, location, limit, budget)]
+
+    def search_keys(
+        self,
+        query: str,
+        location: BookLocation | None = None,
+        limit: int = 20,
+        budget: float = 0.05,
+    ) -> list[DocKey]:
+        with self._lock:
+            terms = [t for t in dict.fromkeys(tokenize(query)) if len(t) > 2]
+            if not terms:
+                return []
+            deadline = time.perf_counter() + budget
+            scores: dict[DocKey, dict[str, float]] = {}
+            for term in terms:
+                for word, score in self.similar_words(term, deadline).items():
+                    for key in self._words[word]:
+                        if location is not None and key[:2] != location:
+                            continue
+                        best = scores.setdefault(key, {})
+                        if score > best.get(term, 0.0):
+                            best[term] = score
+                if time.perf_counter() > deadline:
+                    break
+            # Average over every query term, so a term with no match counts as zero.
+            ranked = sorted(scores.items(), key=lambda item: -sum(item[1].values()) / len(terms))
+            return [key for key, _ in ranked[:limit]]
+
+
+class UserSearchIndex:
+    """Prefix search over account names, usernames, ids and emails.
+
+    Like ``SearchIndex`` every query term is a prefix and all terms must
+    match, but postings are plain sets since results are listed, not ranked.
+    Reads and writes hold the index lock, as in ``SearchIndex``.
+    """
+
+    def __init__(self, role_keys=('students', 'teachers')):
+        self._lock = threading.Lock()
+        self.role_keys = role_keys
+        self._postings: dict[str, set[UserKey]] = {}
+        self._vocabulary: list[str] = []
+        self._doc_tokens: dict[UserKey, set[str]] = {}
+
+    def rebuild(self, users: dict) -> None:
+        with self._lock:
+            self._postings = {}
+            self._doc_tokens = {}
+            for role_key in self.role_keys:
+                for user in users.get(role_key, []):
+                    self._index(role_key, user)
+            self._vocabulary = sorted(self._postings)
+
+    def add(self, role_key: str, user: dict) -> None:
+        with self._lock:
+            if role_key in self.role_keys:
+                for token in self._index(role_key, user):
+                    insort(self._vocabulary, token)
+
+    def remove(self, role_key: str, user_id: str) -> None:
+        with self._lock:
+            key = (role_key, user_id)
+            for token in self._doc_tokens.pop(key, ()):
+                postings = self._postings[token]
+                postings.discard(key)
+                if not postings:
+                    del self._postings[token]
+                    del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _index(self, role_key: str, user: dict) -> list[str]:
+        key = (role_key, user['id'])
+        tokens = {token for field in USER_SEARCH_FIELDS for token in tokenize(user.get(field))}
+        self._doc_tokens[key] = tokens
+        new_tokens = []
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                new_tokens.append(token)
+            postings.add(key)
+        return new_tokens
+
+    def _expand(self, prefix: str) -> set[UserKey]:
+        matched: set[UserKey] = set()
+        for token in self._vocabulary[bisect_left(self._vocabulary, prefix):]:
+            if not token.startswith(prefix):
+                break
+            matched |= self._postings[token]
+        return matched
+
+    def search_keys(self, query: str) -> list[UserKey]:
+        """Accounts matching every term of ``query``, ordered by role then id."""
+        with self._lock:
+            terms = sorted(set(tokenize(query)), key=len, reverse=True)
+            if not terms:
+                return []
+            matched = self._expand(terms[0])
+            for term in terms[1:]:
+                if not matched:
+                    break
+                matched &= self._expand(term)
+            order = {role_key: i for i, role_key in enumerate(self.role_keys)}
+            return sorted(matched, key=lambda key: (order[key[0]], key[1]))
+
+    def __len__(self) -> int:
+        return len(self._doc_tokens)
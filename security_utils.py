@@ -1,13 +1,38 @@
+import atexit
 import base64
+import contextlib
 import hashlib
 import hmac
+import logging
+import multiprocessing
 import os
-from typing import Dict, Tuple
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, List, Tuple
 
-# These defaults keep password hashing consistent across the app.
+logger = logging.getLogger(__name__)
+
+# Parameters of hashes stored before records carried their own; also the default policy.
 _PBKDF2_ALGORITHM = "sha256"
 _PBKDF2_ITERATIONS = 260_000
 _SALT_BYTES = 16
+# Calibration never goes below this, whatever the latency target.
+_MIN_ITERATIONS = 100_000
+
+# Work factor for new hashes: a fixed count, or calibrated to a verify-latency target.
+PBKDF2_ITERATIONS = os.getenv("BOOKFLOW_PBKDF2_ITERATIONS")
+PBKDF2_TARGET_MS = os.getenv("BOOKFLOW_PBKDF2_TARGET_MS")
+
+# Worker processes for PBKDF2; 0 hashes inline on the calling thread.
+HASH_WORKERS = int(os.getenv("BOOKFLOW_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Hashes allowed in flight (running or queued) before callers block.
+HASH_MAX_PENDING = int(os.getenv("BOOKFLOW_HASH_MAX_PENDING", str(max(HASH_WORKERS, 1) * 4)))
+# Pool failures tolerated (each followed by a rebuild) before hashing stays inline.
+HASH_POOL_MAX_FAILURES = int(os.getenv("BOOKFLOW_HASH_POOL_MAX_FAILURES", "3"))
 
 
 def _decode_salt(salt: str) -> bytes:
@@ -23,33 +48,365 @@ def generate_salt() -> str:
     return _encode_bytes(os.urandom(_SALT_BYTES))
 
 
+def generate_token(nbytes: int = 32) -> str:
+    """Random URL-safe token, e.g. for session identifiers."""
+    return base64.urlsafe_b64encode(os.urandom(nbytes)).decode("ascii").rstrip("=")
+
+
+def sign(message: str, key: bytes) -> str:
+    """URL-safe HMAC-SHA256 signature of ``message``."""
+    digest = hmac.new(key, message.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def signature_matches(message: str, signature: str, key: bytes) -> bool:
+    return hmac.compare_digest(sign(message, key), signature)
+
+
+def _pbkdf2(password: str, salt: str, algorithm: str = _PBKDF2_ALGORITHM, iterations: int = _PBKDF2_ITERATIONS) -> str:
+    """Derive the base64 PBKDF2 hash; module level so worker processes can run it."""
+    return _encode_bytes(
+        hashlib.pbkdf2_hmac(
+            algorithm,
+            password.encode("utf-8"),
+            _decode_salt(salt),
+            iterations,
+        )
+    )
+
+
+def calibrate_iterations(target_ms: float, algorithm: str = _PBKDF2_ALGORITHM) -> int:
+    """Iteration count that takes roughly ``target_ms`` to verify on this host.
+
+    Times a short run, scales it to the target and rounds down to a multiple
+    of 10,000, never going below ``_MIN_ITERATIONS``.
+    """
+    sample = 20_000
+    salt = os.urandom(_SALT_BYTES)
+    while True:
+        started = time.perf_counter()
+        hashlib.pbkdf2_hmac(algorithm, b"calibration", salt, sample)
+        elapsed = time.perf_counter() - started
+        if elapsed >= 0.05 or sample >= 5_000_000:
+            break
+        sample *= 4
+    iterations = int(sample * (target_ms / 1000) / elapsed) // 10_000 * 10_000
+    return max(iterations, _MIN_ITERATIONS)
+
+
+_policy: Tuple[str, int] | None = None
+_policy_lock = threading.Lock()
+
+
+def load_password_policy(stored: Dict | None = None) -> Dict | None:
+    """Fix the policy for this process and return the calibration to persist.
+
+    Calibration is noisy, so a result stored by an earlier run (``stored``)
+    is reused as long as the latency target and algorithm are unchanged;
+    otherwise the host is calibrated again. An explicit iteration count
+    needs no calibration and leaves ``stored`` as it is.
+    """
+    global _policy
+    with _policy_lock:
+        calibration = stored
+        if PBKDF2_ITERATIONS:
+            iterations = int(PBKDF2_ITERATIONS)
+        elif PBKDF2_TARGET_MS:
+            target_ms = float(PBKDF2_TARGET_MS)
+            if (
+                stored
+                and stored.get("algorithm") == _PBKDF2_ALGORITHM
+                and stored.get("target_ms") == target_ms
+                and stored.get("iterations")
+            ):
+                iterations = int(stored["iterations"])
+            else:
+                iterations = calibrate_iterations(target_ms)
+                logger.info("Calibrated PBKDF2 to %d iterations for %s ms", iterations, PBKDF2_TARGET_MS)
+                calibration = {"algorithm": _PBKDF2_ALGORITHM, "target_ms": target_ms, "iterations": iterations}
+        else:
+            iterations = _PBKDF2_ITERATIONS
+        _policy = (_PBKDF2_ALGORITHM, iterations)
+        return calibration
+
+
+def password_policy() -> Tuple[str, int]:
+    """``(algorithm, iterations)`` used for new hashes; see ``load_password_policy``."""
+    if _policy is None:
+        load_password_policy()
+    return _policy
+
+
+def _hash_parameters(record: Dict) -> Tuple[str, int]:
+    """Parameters a stored record was hashed with; legacy records predate the fields."""
+    algorithm = record.get("password_algorithm") or f"pbkdf2_{_PBKDF2_ALGORITHM}"
+    return algorithm.removeprefix("pbkdf2_"), int(record.get("password_iterations") or _PBKDF2_ITERATIONS)
+
+
+# Serialises swaps of sys.modules["__main__"] so concurrent submits restore the right module.
+_main_swap_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _script_hidden_from_spawn():
+    """Spawn children without re-running the main script.
+
+    ``spawn`` re-imports ``__main__`` in every child from its ``__file__``.
+    Under Streamlit that is the app script itself, so each worker would build
+    its own library, write the data file and start another outbox worker.
+    A bare module has neither ``__file__`` nor ``__spec__``, so the children
+    import only what they unpickle (this module).
+    """
+    with _main_swap_lock:
+        main = sys.modules.get("__main__")
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
+
+
+class HashingExecutor:
+    """Bounded process pool for PBKDF2 so logins do not serialise on the script thread.
+
+    At most ``max_pending`` hashes are in flight; further submissions block
+    until one finishes. The pool starts on first use with the ``spawn`` method,
+    because forking the multi-threaded Streamlit server is unsafe. Workers
+    are started lazily from ``submit``, which therefore hides the main script
+    while it hands work to the pool. A pool that breaks or cannot start is
+    rebuilt on the next submission; after ``max_failures`` failures hashing
+    stays on the calling thread.
+    """
+
+    def __init__(
+        self,
+        workers: int = HASH_WORKERS,
+        max_pending: int = HASH_MAX_PENDING,
+        max_failures: int = HASH_POOL_MAX_FAILURES,
+    ):
+        self.workers = workers
+        self.max_pending = max(max_pending, 1)
+        self.max_failures = max_failures
+        self.submitted = 0
+        self.inline = 0
+        self.pool_failures = 0
+        self._pending = 0
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _pool_enabled(self) -> bool:
+        return self.workers > 0 and self.pool_failures < self.max_failures
+
+    def _get_pool(self) -> ProcessPoolExecutor | None:
+        with self._lock:
+            if self._pool is None and self._pool_enabled():
+                try:
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                except (OSError, ValueError, NotImplementedError) as exc:
+                    self.pool_failures += 1
+                    logger.warning(
+                        "Hashing pool unavailable (failure %d of %d), hashing inline: %s",
+                        self.pool_failures, self.max_failures, exc,
+                    )
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor, exc: BaseException) -> None:
+        """Drop a broken pool so the next submission builds a fresh one."""
+        with self._lock:
+            if self._pool is not pool:
+                return  # another thread already replaced it
+            self._pool = None
+            self.pool_failures += 1
+            failures = self.pool_failures
+        logger.warning(
+            "Hashing pool failed (failure %d of %d), hashing inline: %s", failures, self.max_failures, exc
+        )
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, password: str, salt: str, algorithm: str = _PBKDF2_ALGORITHM, iterations: int = _PBKDF2_ITERATIONS) -> Future:
+        """Queue one hash; the future resolves to the base64 hash string."""
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+            self.submitted += 1
+        # Until the done-callback owns the slot, any exception must give it back.
+        handed_off = False
+        try:
+            future = None
+            pool = self._get_pool()
+            if pool is not None:
+                try:
+                    with _script_hidden_from_spawn():
+                        future = pool.submit(_pbkdf2, password, salt, algorithm, iterations)
+                except Exception as exc:
+                    self._discard_pool(pool, exc)
+            if future is None:
+                future = Future()
+                with self._lock:
+                    self.inline += 1
+                try:
+                    future.set_result(_pbkdf2(password, salt, algorithm, iterations))
+                except BaseException as exc:
+                    future.set_exception(exc)
+            future.add_done_callback(self._release)
+            handed_off = True
+            return future
+        finally:
+            if not handed_off:
+                self._release(None)
+
+    def _release(self, _future: Future | None) -> None:
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def hash(self, password: str, salt: str, algorithm: str = _PBKDF2_ALGORITHM, iterations: int = _PBKDF2_ITERATIONS) -> str:
+        """Synchronous facade: hash in the pool and wait for the result."""
+        future = self.submit(password, salt, algorithm, iterations)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # A worker died mid-hash; do this one inline rather than fail the login.
+            return _pbkdf2(password, salt, algorithm, iterations)
+
+    @property
+    def queue_depth(self) -> int:
+        """Hashes submitted but not yet finished."""
+        with self._lock:
+            return self._pending
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers if self._pool_enabled() else 0,
+                "pool_failures": self.pool_failures,
+                "max_pending": self.max_pending,
+                "queue_depth": self._pending,
+                "submitted": self.submitted,
+                "inline": self.inline,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+hashing_executor = HashingExecutor()
+atexit.register(hashing_executor.shutdown)
+
+
 def hash_password(password: str, salt: str | None = None) -> Tuple[str, str]:
-    """Create a PBKDF2 hash for the provided password.
+    """Create a PBKDF2 hash for the provided password under the legacy parameters.
 
     Returns a tuple of (password_hash, salt) where both values are base64 strings.
+    The work runs on ``hashing_executor``; the call blocks until it is done.
+    New credentials should use ``hash_password_record`` instead.
     """
     if salt is None:
         salt = generate_salt()
 
-    password_hash = hashlib.pbkdf2_hmac(
-        _PBKDF2_ALGORITHM,
-        password.encode("utf-8"),
-        _decode_salt(salt),
-        _PBKDF2_ITERATIONS,
-    )
+    return hashing_executor.hash(password, salt), salt
+
+
+def hash_password_record(password: str) -> Dict[str, object]:
+    """Hash under the current policy; returns the fields to store on the user."""
+    algorithm, iterations = password_policy()
+    salt = generate_salt()
+    return {
+        "password_hash": hashing_executor.hash(password, salt, algorithm, iterations),
+        "password_salt": salt,
+        "password_algorithm": f"pbkdf2_{algorithm}",
+        "password_iterations": iterations,
+    }
+
 
-    return _encode_bytes(password_hash), salt
+def hash_password_records(
+    passwords: Iterable[str],
+    progress: Callable[[int, int], None] | None = None,
+) -> List[Dict[str, object]]:
+    """Hash many passwords under the current policy across the hashing pool.
+
+    Records come back in input order. ``progress(done, total)`` is called as
+    each hash finishes, from the pool's callback thread.
+    """
+    algorithm, iterations = password_policy()
+    passwords = list(passwords)
+    salts = [generate_salt() for _ in passwords]
+    total = len(passwords)
+    done = 0
+    done_lock = threading.Lock()
+
+    def report(_future: Future) -> None:
+        nonlocal done
+        with done_lock:
+            done += 1
+            count = done
+        if progress is not None:
+            progress(count, total)
+
+    futures = []
+    for password, salt in zip(passwords, salts):
+        future = hashing_executor.submit(password, salt, algorithm, iterations)
+        future.add_done_callback(report)
+        futures.append(future)
+
+    records = []
+    for password, salt, future in zip(passwords, salts, futures):
+        try:
+            password_hash = future.result()
+        except BrokenProcessPool:
+            password_hash = _pbkdf2(password, salt, algorithm, iterations)
+        records.append({
+            "password_hash": password_hash,
+            "password_salt": salt,
+            "password_algorithm": f"pbkdf2_{algorithm}",
+            "password_iterations": iterations,
+        })
+    return records
 
 
-def verify_password(password: str, password_hash: str | None, salt: str | None) -> bool:
+def verify_password(
+    password: str,
+    password_hash: str | None,
+    salt: str | None,
+    algorithm: str = _PBKDF2_ALGORITHM,
+    iterations: int = _PBKDF2_ITERATIONS,
+) -> bool:
     """Verify a plaintext password against a stored hash and salt."""
     if not password_hash or not salt:
         return False
 
-    candidate_hash, _ = hash_password(password, salt)
+    candidate_hash = hashing_executor.hash(password, salt, algorithm, iterations)
     return hmac.compare_digest(candidate_hash, password_hash)
 
 
+def hash_parameter_fields(user: Dict) -> Dict[str, object]:
+    """Algorithm and iteration fields describing the hash already stored on ``user``."""
+    algorithm, iterations = _hash_parameters(user)
+    return {"password_algorithm": f"pbkdf2_{algorithm}", "password_iterations": iterations}
+
+
+def verify_user_password(user: Dict, password: str) -> bool:
+    """Verify ``password`` against a user record using the parameters stored on it."""
+    algorithm, iterations = _hash_parameters(user)
+    return verify_password(password, user.get("password_hash"), user.get("password_salt"), algorithm, iterations)
+
+
+def needs_rehash(user: Dict) -> bool:
+    """True when a record is weaker than the current policy or uses another algorithm.
+
+    Records with more iterations than the policy are left alone, so a lower
+    calibration never weakens existing hashes. Records without parameters
+    are judged by the legacy ones they were made with.
+    """
+    algorithm, iterations = _hash_parameters(user)
+    policy_algorithm, policy_iterations = password_policy()
+    return algorithm != policy_algorithm or iterations < policy_iterations
+
+
 def ensure_password_fields(user: Dict[str, str]) -> bool:
     """Ensure the given user dict stores hashed credentials only.
 
@@ -66,9 +423,30 @@ def ensure_password_fields(user: Dict[str, str]) -> bool:
 
     plaintext = user.pop("password", None)
     if plaintext:
-        password_hash, password_salt = hash_password(plaintext)
-        user["password_hash"] = password_hash
-        user["password_salt"] = password_salt
+        user.update(hash_password_record(plaintext))
         mutated = True
 
     return mutated
+
+
+def ensure_password_fields_many(
+    users: Iterable[Dict],
+    progress: Callable[[int, int], None] | None = None,
+) -> int:
+    """Batch form of ``ensure_password_fields``; returns how many users were changed."""
+    mutated = 0
+    pending = []
+    for user in users:
+        if "password_hash" in user and "password_salt" in user:
+            if "password" in user:
+                user.pop("password")
+                mutated += 1
+        elif user.get("password"):
+            pending.append(user)
+        else:
+            user.pop("password", None)
+
+    records = hash_password_records((user.pop("password") for user in pending), progress)
+    for user, record in zip(pending, records):
+        user.update(record)
+    return mutated + len(pending)
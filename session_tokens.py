@@ -0,0 +1,139 @@
+"""Signed, expiring login tokens so a reconnecting browser skips the password check."""
+
+from __future__ import annotations
+
+import hmac
+import json
+import os
+import threading
+import time
+
+import streamlit as st
+
+from security_utils import generate_token, sign, signature_matches
+
+# Cookie that carries the token between page loads; it never appears in the URL.
+SESSION_COOKIE = 'bookflow_session'
+SESSION_TTL_SECONDS = float(os.getenv('BOOKFLOW_SESSION_TTL_HOURS', '12')) * 3600
+PURGE_INTERVAL_SECONDS = 300
+
+
+class SessionTokens:
+    """Server-side table of issued tokens, keyed by token id.
+
+    A token reads ``<id>.<expiry>.<signature>``. The HMAC rejects forged or
+    altered tokens before the table is consulted, and the table is what makes
+    a token valid at all, so revoking one is a dict delete. The table lives
+    in memory, so a server restart signs everybody out.
+
+    Each token is also bound to a caller-supplied string (the browser's
+    User-Agent), so a copied token does not work from a different browser.
+    """
+
+    def __init__(self, secret: bytes | None = None, ttl: float = SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._secret = secret or os.urandom(32)
+        self._last_purge = time.monotonic()
+        self._tokens: dict[str, tuple[str, str, float, str]] = {}
+        self._by_user: dict[tuple[str, str], set[str]] = {}
+        self._lock = threading.Lock()
+
+    def issue(self, role_key: str, user_id: str, binding: str = '') -> str:
+        """Record a new session for ``user_id`` and return its signed token."""
+        token_id = generate_token()
+        expires = int(time.time() + self.ttl)
+        with self._lock:
+            self._purge_expired()
+            self._tokens[token_id] = (role_key, user_id, expires, sign(binding, self._secret))
+            self._by_user.setdefault((role_key, user_id), set()).add(token_id)
+        payload = f'{token_id}.{expires}'
+        return f'{payload}.{sign(payload, self._secret)}'
+
+    def validate(self, token: str, binding: str = '') -> tuple[str, str] | None:
+        """``(role_key, user_id)`` for a live token presented with the binding it was issued for.
+
+        None if the token is forged, expired, revoked or bound to something else.
+        """
+        token_id = self._token_id(token)
+        if token_id is None:
+            return None
+        with self._lock:
+            entry = self._tokens.get(token_id)
+            if entry is None:
+                return None
+            role_key, user_id, expires, bound_to = entry
+            if expires <= time.time():
+                self._drop(token_id)
+                return None
+            if not hmac.compare_digest(bound_to, sign(binding, self._secret)):
+                return None
+            return role_key, user_id
+
+    def revoke(self, token: str) -> None:
+        token_id = self._token_id(token)
+        if token_id is not None:
+            with self._lock:
+                self._drop(token_id)
+
+    def revoke_user(self, role_key: str, user_id: str) -> None:
+        """End every session of one account, e.g. after deletion or a password reset."""
+        with self._lock:
+            for token_id in self._by_user.pop((role_key, user_id), set()):
+                self._tokens.pop(token_id, None)
+
+    def _token_id(self, token: str) -> str | None:
+        try:
+            token_id, expires, signature = token.split('.')
+        except (AttributeError, ValueError):
+            return None
+        if not signature_matches(f'{token_id}.{expires}', signature, self._secret):
+            return None
+        return token_id
+
+    def _drop(self, token_id: str) -> None:
+        entry = self._tokens.pop(token_id, None)
+        if entry is None:
+            return
+        role_key, user_id = entry[:2]
+        tokens = self._by_user.get((role_key, user_id))
+        if tokens is not None:
+            tokens.discard(token_id)
+            if not tokens:
+                del self._by_user[(role_key, user_id)]
+
+    def _purge_expired(self) -> None:
+        if time.monotonic() - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = time.monotonic()
+        now = time.time()
+        for token_id in [t for t, entry in self._tokens.items() if entry[2] <= now]:
+            self._drop(token_id)
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+
+def session_binding() -> str:
+    """What a session token is bound to: the browser's User-Agent."""
+    return st.context.headers.get('User-Agent', '')
+
+
+def begin_session(role: str, user: dict):
+    """Issue a session token for a fresh login; main() hands it to the browser as a cookie."""
+    token = st.session_state.app.start_session(role, user, session_binding())
+    st.session_state.session_token = token
+    st.session_state.session_cookie = (token, int(st.session_state.app.session_tokens.ttl))
+
+
+def write_session_cookie():
+    """Set or clear the session cookie queued by a login or logout, once."""
+    pending = st.session_state.pop('session_cookie', None)
+    if pending is None:
+        return
+    value, max_age = pending
+    secure = '; Secure' if (st.context.url or '').startswith('https:') else ''
+    st.html(
+        f"<script>document.cookie = {json.dumps(f'{SESSION_COOKIE}={value}')}"
+        f" + '; path=/; max-age={max_age}; SameSite=Strict{secure}';</script>",
+        unsafe_allow_javascript=True,
+    )
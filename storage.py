@@ -0,0 +1,520 @@
+"""Persistence helpers for BookFlow LMS data."""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Iterator
+
+# Once the journal grows past this many bytes it is folded back into a snapshot.
+JOURNAL_COMPACT_BYTES = 256 * 1024
+
+USER_ROLES = ('students', 'teachers', 'admin')
+
+# Top-level parts of the data tree that can be marked dirty independently.
+DATA_SECTIONS = ('users', 'books', 'transactions', 'reservations')
+
+
+def journal_path_for(data_file: str) -> str:
+    """Return the journal file that sits next to a snapshot file."""
+    root, _ = os.path.splitext(data_file)
+    return f"{root}.journal"
+
+
+def _file_mode(path: str) -> int:
+    """Permission bits of ``path``, or what the umask gives a new file."""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def atomic_write_json(path: str, data, indent: int | None = 4) -> None:
+    """Write JSON via a temp file, fsync and rename so readers never see a torn file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.bookflow-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates 0600 files; keep the mode the data file already had.
+        os.chmod(tmp_path, _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if hasattr(os, 'O_DIRECTORY'):
+        # Persist the rename itself, not just the file contents.
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def find_book(
+    books: dict,
+    book_id: str,
+    programme: str | None = None,
+    collection: str | None = None,
+) -> dict | None:
+    """Locate a book record inside the nested books structure."""
+    if programme:
+        candidates = books.get('program_books', {}).get(programme, [])
+    elif collection:
+        candidates = books.get('collection_catalog', {}).get(collection, [])
+    else:
+        candidates = books.get('teacher_books', [])
+    return next((b for b in candidates if b.get('id') == book_id), None)
+
+
+def apply_record(data: dict, record: dict) -> None:
+    """Apply a single journal record to the in-memory data tree.
+
+    Records carry resulting values rather than deltas so replaying a record
+    that already made it into the snapshot leaves the data unchanged.
+    """
+    op = record.get('op')
+    books = data.setdefault('books', {})
+
+    if op in ('borrow', 'return'):
+        book = find_book(books, record.get('book_id'), record.get('programme'), record.get('collection'))
+        if book is not None and 'available' in record:
+            book['available'] = record['available']
+
+    if op == 'borrow':
+        transactions = data.setdefault('transactions', [])
+        transaction = record['transaction']
+        if not any(t.get('id') == transaction.get('id') for t in transactions):
+            transactions.append(dict(transaction))
+    elif op == 'return':
+        for trans in data.setdefault('transactions', []):
+            if trans.get('id') == record.get('transaction_id'):
+                trans['status'] = 'returned'
+                trans['return_date'] = record.get('return_date')
+                trans['fine'] = record.get('fine', trans.get('fine', 0))
+                break
+    elif op == 'reserve':
+        reservations = data.setdefault('reservations', [])
+        reservation = record['reservation']
+        if not any(r.get('id') == reservation.get('id') for r in reservations):
+            reservations.append(dict(reservation))
+    elif op == 'email':
+        for user in data.setdefault('users', {}).get(record.get('role'), []):
+            if user.get('id') == record.get('user_id'):
+                user['email'] = record.get('email')
+                break
+
+
+class TransactionJournal:
+    """Append-only log of mutations recorded since the last snapshot."""
+
+    def __init__(self, path: str, compact_bytes: int = JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.compact_bytes = compact_bytes
+
+    def append(self, record: dict) -> None:
+        """Write one compact record and make sure it reaches the disk."""
+        line = json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay(self) -> Iterator[dict]:
+        """Yield the stored records in the order they were written.
+
+        A torn write leaves an unterminated or undecodable line; the file is
+        cut back to the end of the last complete record so later appends
+        start on a fresh line instead of being glued onto the broken one.
+        """
+        try:
+            f = open(self.path, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            good_end = 0
+            for raw in f:
+                try:
+                    if not raw.endswith(b'\n'):
+                        raise ValueError('unterminated record')
+                    line = raw.decode('utf-8').strip()
+                    record = json.loads(line) if line else None
+                except ValueError:
+                    # Everything from the torn write onwards is unusable.
+                    f.truncate(good_end)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    return
+                good_end += len(raw)
+                if record is not None:
+                    yield record
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def needs_compaction(self) -> bool:
+        return self.size() >= self.compact_bytes
+
+    def reset(self) -> None:
+        """Drop every record, typically right after a fresh snapshot."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class LibraryStorage:
+    """Interface shared by the BookFlow storage backends.
+
+    Backends exchange the same nested ``users``/``books``/``transactions``/
+    ``reservations`` dict that ``BookFlowApp`` keeps in memory.
+    """
+
+    def load(self) -> dict | None:
+        """Return the stored data, or None when nothing has been saved yet."""
+        raise NotImplementedError
+
+    def save(self, data: dict, sections=None) -> None:
+        """Persist ``data``; ``sections`` limits the write to the dirty parts when given."""
+        raise NotImplementedError
+
+    def record(self, record: dict, data: dict) -> None:
+        """Persist a single mutation that has already been applied to ``data``."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JsonFileStorage(LibraryStorage):
+    """Single JSON snapshot file plus an append-only journal."""
+
+    def __init__(self, data_file: str, compact_bytes: int = JOURNAL_COMPACT_BYTES):
+        self.data_file = data_file
+        self.journal = TransactionJournal(journal_path_for(data_file), compact_bytes)
+
+    def load(self) -> dict | None:
+        try:
+            with open(self.data_file, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        for record in self.journal.replay():
+            apply_record(data, record)
+        return data
+
+    def save(self, data: dict, sections=None) -> None:
+        # A single file cannot be patched in place, so every save is a full snapshot.
+        atomic_write_json(self.data_file, data)
+        # The snapshot now contains every journaled change.
+        self.journal.reset()
+
+    def record(self, record: dict, data: dict) -> None:
+        self.journal.append(record)
+        if self.journal.needs_compaction():
+            self.save(data)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    role TEXT NOT NULL,
+    id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (role, id)
+);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users (role, username COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS books (
+    catalog TEXT NOT NULL,
+    location TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    available INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    PRIMARY KEY (catalog, location, id)
+);
+CREATE INDEX IF NOT EXISTS idx_books_id ON books (id);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER,
+    user_id TEXT,
+    book_id TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_id ON transactions (id);
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, status);
+CREATE INDEX IF NOT EXISTS idx_transactions_book ON transactions (book_id, status);
+CREATE TABLE IF NOT EXISTS reservations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE,
+    user_id TEXT,
+    book_id TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_book ON reservations (book_id, status);
+CREATE INDEX IF NOT EXISTS idx_reservations_user ON reservations (user_id, book_id);
+"""
+
+
+def _dump(value) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def iter_book_rows(books: dict) -> Iterator[tuple[str, str, dict]]:
+    """Flatten the nested books structure into (catalog, location, book) rows."""
+    for programme, entries in books.get('program_books', {}).items():
+        for book in entries:
+            yield 'program', programme, book
+    for book in books.get('teacher_books', []):
+        yield 'teacher', '', book
+    for name, entries in books.get('collection_catalog', {}).items():
+        for book in entries:
+            yield 'collection', name, book
+
+
+def _record_location(record: dict) -> tuple[str, str]:
+    if record.get('programme'):
+        return 'program', record['programme']
+    if record.get('collection'):
+        return 'collection', record['collection']
+    return 'teacher', ''
+
+
+class SQLiteStorage(LibraryStorage):
+    """SQLite database in WAL mode with one indexed table per entity.
+
+    Full snapshots rewrite every table inside one transaction, while
+    journal-style mutations become single-row inserts and updates.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Streamlit serves sessions from several threads; access is serialised by _lock.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SQLITE_SCHEMA)
+
+    def load(self) -> dict | None:
+        with self._lock:
+            conn = self._conn
+            if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0 and (
+                conn.execute('SELECT COUNT(*) FROM books').fetchone()[0] == 0
+            ):
+                return None
+
+            users: dict[str, list[dict]] = {role: [] for role in USER_ROLES}
+            for role, payload in conn.execute('SELECT role, data FROM users ORDER BY position'):
+                users.setdefault(role, []).append(json.loads(payload))
+
+            books: dict = {'program_books': {}, 'teacher_books': [], 'collection_catalog': {}}
+            rows = conn.execute('SELECT catalog, location, available, data FROM books ORDER BY position')
+            for catalog, location, available, payload in rows:
+                book = json.loads(payload)
+                book['available'] = available
+                if catalog == 'program':
+                    books['program_books'].setdefault(location, []).append(book)
+                elif catalog == 'collection':
+                    books['collection_catalog'].setdefault(location, []).append(book)
+                else:
+                    books['teacher_books'].append(book)
+
+            transactions = [
+                json.loads(payload) for (payload,) in conn.execute('SELECT data FROM transactions ORDER BY seq')
+            ]
+            reservations = [
+                json.loads(payload) for (payload,) in conn.execute('SELECT data FROM reservations ORDER BY seq')
+            ]
+            data = {
+                'users': users,
+                'books': books,
+                'transactions': transactions,
+                'reservations': reservations,
+            }
+            meta = {key: json.loads(value) for key, value in conn.execute('SELECT key, value FROM meta')}
+            if meta:
+                data['meta'] = meta
+            return data
+
+    def save(self, data: dict, sections=None) -> None:
+        sections = set(DATA_SECTIONS if sections is None else sections)
+        with self._lock, self._conn as conn:
+            for table in DATA_SECTIONS:
+                if table in sections:
+                    conn.execute(f'DELETE FROM {table}')
+
+            if 'users' in sections:
+                self._insert_users(conn, data)
+            if 'books' in sections:
+                self._insert_books(conn, data)
+            if 'transactions' in sections:
+                self._insert_transactions(conn, data)
+            if 'reservations' in sections:
+                self._insert_reservations(conn, data)
+            for key, value in data.get('meta', {}).items():
+                conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, _dump(value)))
+
+    @staticmethod
+    def _insert_users(conn: sqlite3.Connection, data: dict) -> None:
+        conn.executemany(
+            'INSERT OR REPLACE INTO users (role, id, username, position, data) VALUES (?, ?, ?, ?, ?)',
+            (
+                (role, user.get('id'), user.get('username', ''), position, _dump(user))
+                for role, entries in data.get('users', {}).items()
+                for position, user in enumerate(entries)
+            ),
+        )
+
+    @staticmethod
+    def _insert_books(conn: sqlite3.Connection, data: dict) -> None:
+        conn.executemany(
+            'INSERT OR REPLACE INTO books (catalog, location, id, position, available, data) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                (catalog, location, book.get('id'), position, int(book.get('available', 0) or 0), _dump(book))
+                for position, (catalog, location, book) in enumerate(iter_book_rows(data.get('books', {})))
+            ),
+        )
+
+    @staticmethod
+    def _insert_transactions(conn: sqlite3.Connection, data: dict) -> None:
+        conn.executemany(
+            'INSERT INTO transactions (id, user_id, book_id, status, data) VALUES (?, ?, ?, ?, ?)',
+            (
+                (t.get('id'), t.get('user_id'), t.get('book_id'), t.get('status'), _dump(t))
+                for t in data.get('transactions', [])
+            ),
+        )
+
+    @staticmethod
+    def _insert_reservations(conn: sqlite3.Connection, data: dict) -> None:
+        conn.executemany(
+            'INSERT OR REPLACE INTO reservations (id, user_id, book_id, status, data) VALUES (?, ?, ?, ?, ?)',
+            (
+                (r.get('id'), r.get('user_id'), r.get('book_id'), r.get('status'), _dump(r))
+                for r in data.get('reservations', [])
+            ),
+        )
+
+    def record(self, record: dict, data: dict) -> None:
+        op = record.get('op')
+        with self._lock, self._conn as conn:
+            if op in ('borrow', 'return') and 'available' in record:
+                catalog, location = _record_location(record)
+                conn.execute(
+                    'UPDATE books SET available = ? WHERE catalog = ? AND location = ? AND id = ?',
+                    (record['available'], catalog, location, record.get('book_id')),
+                )
+
+            if op == 'borrow':
+                trans = record['transaction']
+                exists = conn.execute('SELECT 1 FROM transactions WHERE id = ?', (trans.get('id'),)).fetchone()
+                if not exists:
+                    conn.execute(
+                        'INSERT INTO transactions (id, user_id, book_id, status, data) VALUES (?, ?, ?, ?, ?)',
+                        (trans.get('id'), trans.get('user_id'), trans.get('book_id'), trans.get('status'), _dump(trans)),
+                    )
+            elif op == 'return':
+                trans = next(
+                    (t for t in data.get('transactions', []) if t.get('id') == record.get('transaction_id')),
+                    None,
+                )
+                if trans is not None:
+                    conn.execute(
+                        'UPDATE transactions SET status = ?, data = ? WHERE id = ?',
+                        (trans.get('status'), _dump(trans), trans.get('id')),
+                    )
+            elif op == 'reserve':
+                reservation = record['reservation']
+                conn.execute(
+                    'INSERT OR IGNORE INTO reservations (id, user_id, book_id, status, data) VALUES (?, ?, ?, ?, ?)',
+                    (
+                        reservation.get('id'),
+                        reservation.get('user_id'),
+                        reservation.get('book_id'),
+                        reservation.get('status'),
+                        _dump(reservation),
+                    ),
+                )
+            elif op == 'email':
+                user = next(
+                    (u for u in data.get('users', {}).get(record.get('role'), []) if u.get('id') == record.get('user_id')),
+                    None,
+                )
+                if user is not None:
+                    conn.execute(
+                        'UPDATE users SET data = ? WHERE role = ? AND id = ?',
+                        (_dump(user), record.get('role'), user.get('id')),
+                    )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_storage(data_file: str) -> LibraryStorage:
+    """Build the backend selected by ``BOOKFLOW_STORAGE`` (``json`` or ``sqlite``)."""
+    backend = os.getenv('BOOKFLOW_STORAGE', 'json').strip().lower()
+    if backend == 'sqlite':
+        root, _ = os.path.splitext(data_file)
+        return SQLiteStorage(os.getenv('BOOKFLOW_SQLITE_PATH', f"{root}.db"))
+    if backend != 'json':
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return JsonFileStorage(data_file)
+
+
+def migrate_json_to_sqlite(json_path: str, db_path: str) -> dict[str, int]:
+    """Copy an existing bookflow_data.json layout into an SQLite database.
+
+    Returns the number of rows written per table.
+    """
+    data = JsonFileStorage(json_path).load()
+    if data is None:
+        raise FileNotFoundError(json_path)
+
+    target = SQLiteStorage(db_path)
+    try:
+        target.save(data)
+    finally:
+        target.close()
+
+    books = data.get('books', {})
+    return {
+        'users': sum(len(entries) for entries in data.get('users', {}).values()),
+        'books': sum(1 for _ in iter_book_rows(books)),
+        'transactions': len(data.get('transactions', [])),
+        'reservations': len(data.get('reservations', [])),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Migrate BookFlow JSON data into SQLite.')
+    parser.add_argument('source', nargs='?', default='bookflow_data.json')
+    parser.add_argument('target', nargs='?', default='bookflow_data.db')
+    args = parser.parse_args()
+    counts = migrate_json_to_sqlite(args.source, args.target)
+    print(', '.join(f"{table}: {count}" for table, count in counts.items()))
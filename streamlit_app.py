@@ -1,17 +1,44 @@
 import streamlit as st
 import streamlit.components.v1 as components
+import atexit
+import hashlib
 import json
+import logging
 import os
 from datetime import datetime, timedelta
 import re
 import html
-import smtplib
-import ssl
+import threading
+import time
 from email.message import EmailMessage
 
 from admin_portal import admin_dashboard, admin_login_page
+from fragment_cache import FragmentCache
+from library_index import (
+    BookIndex,
+    LatestBooks,
+    LibraryStats,
+    TransactionIndex,
+    UserDirectory,
+    book_key,
+    book_location,
+    transaction_location,
+)
+from outbox import EmailOutbox, email_setting, smtp_config_error
 from program_catalog import PROGRAM_CATEGORIES, all_programmes, programme_category
-from security_utils import ensure_password_fields, hash_password, verify_password
+from search import SearchIndex, TrigramIndex, UserSearchIndex
+from security_utils import (
+    ensure_password_fields,
+    ensure_password_fields_many,
+    hash_parameter_fields,
+    hash_password_record,
+    load_password_policy,
+    needs_rehash,
+    verify_user_password,
+)
+from session_tokens import SESSION_COOKIE, SessionTokens, begin_session, session_binding, write_session_cookie
+from storage import DATA_SECTIONS, iter_book_rows, open_storage
+from transaction_browser import TransactionFrame
 
 # Page config
 st.set_page_config(
@@ -1001,11 +1028,13 @@ def _make_program_book_entry(template: dict, programme: str, category: str, slug
     return entry
 
 
-def build_default_program_books():
+def build_default_program_books(only: list[str] | None = None):
     program_books = {}
     for category, programmes in PROGRAM_CATEGORIES.items():
         templates = DEFAULT_CATEGORY_BOOKS.get(category, [])
         for programme in programmes:
+            if only is not None and programme not in only:
+                continue
             slug = _slugify_program(programme)
             program_books[programme] = [
                 _make_program_book_entry(template, programme, category, slug)
@@ -1014,25 +1043,41 @@ def build_default_program_books():
     return program_books
 
 
+def _content_hash(value) -> str:
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def default_catalog_hash() -> str:
+    """Hash every seed template; unchanged defaults mean seeding can be skipped."""
+    return _content_hash([DEFAULT_CATEGORY_BOOKS, GENERAL_LIBRARY_BOOKS, COLLECTION_DEFAULTS, PROGRAM_CATEGORIES])
+
+
+def default_seed_fingerprints() -> dict[str, dict[str, str]]:
+    """Per-programme and per-collection hashes of the seed templates."""
+    programmes = {
+        programme: _content_hash([category, programme, DEFAULT_CATEGORY_BOOKS.get(category, [])])
+        for category, names in PROGRAM_CATEGORIES.items()
+        for programme in names
+    }
+    programmes['General Library'] = _content_hash(GENERAL_LIBRARY_BOOKS)
+    collections = {name: _content_hash(entries) for name, entries in COLLECTION_DEFAULTS.items()}
+    return {'programmes': programmes, 'collections': collections}
+
+
 def programme_books(programme: str) -> list[dict]:
     return st.session_state.app.books.get('program_books', {}).get(programme, [])
 
 
 def get_latest_programme_books(programme: str, limit: int = 5) -> list[dict]:
-    books = programme_books(programme)
-    if not books:
-        return []
-    sorted_books = sorted(
-        books,
-        key=lambda b: b.get('added_at') or b.get('title_signature', ''),
-        reverse=True,
-    )
-    return sorted_books[:limit]
+    return st.session_state.app.latest_books.top(programme, limit)
 
 
-def build_collection_catalog() -> dict[str, list[dict]]:
+def build_collection_catalog(only: list[str] | None = None) -> dict[str, list[dict]]:
     catalog: dict[str, list[dict]] = {}
     for name, entries in COLLECTION_DEFAULTS.items():
+        if only is not None and name not in only:
+            continue
         prepared: list[dict] = []
         for template in entries:
             item = dict(template)
@@ -1073,34 +1118,14 @@ def borrowable_collection_items() -> list[dict]:
     return items
 
 
-def _email_setting(name: str) -> str | None:
-    value = os.getenv(name)
-    return value.strip() if isinstance(value, str) and value.strip() else None
-
-
-def send_reservation_email(
+def build_reservation_email(
     to_email: str,
     user_name: str,
     book: dict,
     reservation: dict,
-) -> tuple[bool, str | None]:
-    smtp_server = _email_setting("BOOKFLOW_SMTP_SERVER")
-    smtp_port = _email_setting("BOOKFLOW_SMTP_PORT") or "465"
-    smtp_username = _email_setting("BOOKFLOW_SMTP_USERNAME")
-    smtp_password = _email_setting("BOOKFLOW_SMTP_PASSWORD")
-    sender_email = _email_setting("BOOKFLOW_EMAIL_SENDER") or smtp_username
-
-    if not all([smtp_server, smtp_username, smtp_password, sender_email]):
-        return False, (
-            "SMTP settings are incomplete. Set BOOKFLOW_SMTP_SERVER, BOOKFLOW_SMTP_PORT, "
-            "BOOKFLOW_SMTP_USERNAME, BOOKFLOW_SMTP_PASSWORD, and BOOKFLOW_EMAIL_SENDER."
-        )
-
-    try:
-        port = int(smtp_port)
-    except ValueError:
-        return False, f"Invalid SMTP port: {smtp_port}"
-
+) -> EmailMessage:
+    """Reservation confirmation, ready to be queued on the outbox."""
+    sender_email = email_setting("BOOKFLOW_EMAIL_SENDER") or email_setting("BOOKFLOW_SMTP_USERNAME")
     book_title = book.get('title', 'Requested Book')
     programme = book.get('programme') or 'General Library'
     subject = f"Reservation confirmed for \"{book_title}\""
@@ -1108,7 +1133,8 @@ def send_reservation_email(
 
     message = EmailMessage()
     message["Subject"] = subject
-    message["From"] = sender_email
+    if sender_email:
+        message["From"] = sender_email
     message["To"] = to_email
     message.set_content(
         f"Hello {user_name},\n\n"
@@ -1120,35 +1146,18 @@ def send_reservation_email(
         "We'll notify you as soon as a copy becomes available.\n\n"
         "Thank you for using BookFlow!"
     )
+    return message
 
-    try:
-        context = ssl.create_default_context()
-        if port == 465:
-            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                server.login(smtp_username, smtp_password)
-                server.send_message(message)
-        else:
-            with smtplib.SMTP(smtp_server, port, timeout=20) as server:
-                server.ehlo()
-                server.starttls(context=context)
-                server.ehlo()
-                server.login(smtp_username, smtp_password)
-                server.send_message(message)
-        return True, None
-    except smtplib.SMTPAuthenticationError as exc:
-        detail = None
-        if getattr(exc, "smtp_error", None):
-            try:
-                detail = exc.smtp_error.decode("utf-8", errors="ignore")
-            except AttributeError:
-                detail = str(exc.smtp_error)
-        return False, (
-            f"Authentication failed: {detail.strip()}" if detail else "Authentication failed: check username/app password."
-        )
-    except smtplib.SMTPConnectError as exc:
-        return False, f"Connection error: {exc.smtp_error.decode() if getattr(exc, 'smtp_error', None) else exc}"
-    except Exception as exc:  # pragma: no cover - depends on external SMTP
-        return False, str(exc)
+
+def email_delivery_label(delivery: dict) -> str:
+    """Short, user-facing description of an outbox delivery state."""
+    if delivery['status'] == 'sent':
+        return "delivered"
+    if delivery['status'] == 'dead':
+        return "could not be delivered"
+    if delivery['attempts']:
+        return f"retrying (attempt {delivery['attempts']} failed)"
+    return "queued"
 
 
 def _render_programme_carousel(programme: str, books: list[dict], slider_key: str) -> None:
@@ -1326,39 +1335,141 @@ def _render_programme_carousel(programme: str, books: list[dict], slider_key: st
     )
 
 
+logger = logging.getLogger("bookflow")
+# Streamlit only configures its own loggers; without a handler these INFO lines would be dropped.
+# The script module runs again on every rerun, so the handler is attached once.
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.getenv('BOOKFLOW_LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+
+def log_hash_progress(done: int, total: int) -> None:
+    """Log bulk password hashing roughly every 10%, for rosters large enough to notice."""
+    step = max(total // 10, 1)
+    if total >= 100 and (done % step == 0 or done == total):
+        logger.info("Hashed %d/%d passwords", done, total)
+
+
+# Backstop for writes made outside a script run; reruns flush on their own when they finish.
+SAVE_DEBOUNCE_SECONDS = 2.0
+BOOK_PAGE_SIZES = (10, 25, 50)
+# How stale the dashboard counters may get before a full recount checks them for drift.
+STATS_RECOUNT_SECONDS = float(os.getenv('BOOKFLOW_STATS_RECOUNT_SECONDS', '300'))
+# Fragment key of the card grid, so callbacks can rerun just that part of the page.
+BOOK_CARDS_FRAGMENT = "book_cards"
+FRAGMENT_CACHE_SIZE = int(os.getenv('BOOKFLOW_FRAGMENT_CACHE_SIZE', '2048'))
+# Session-state role -> key of its account list in ``users``.
+ROLE_KEYS = {'student': 'students', 'teacher': 'teachers', 'admin': 'admin'}
+
+
 class BookFlowApp:
+    # Ordered (version, method) pairs. Each runs once per data file, which then
+    # records the highest version applied in meta.schema_version.
+    MIGRATIONS = (
+        (1, 'migrate_user_contact_fields'),
+        (2, 'migrate_user_password_fields'),
+        (3, 'migrate_program_books'),
+        (4, 'migrate_user_program_fields'),
+        (5, 'seed_program_books'),
+        (6, 'seed_collection_catalog'),
+        (7, 'normalize_book_metadata'),
+    )
+
     def __init__(self):
         self.data_file = "bookflow_data.json"
+        self.storage = open_storage(self.data_file)
+        # One instance is shared by every session; writers serialise on this lock.
+        self.lock = threading.RLock()
+        self._dirty: set[str] = set()
+        self._flush_timer: threading.Timer | None = None
         self.reservations: list[dict] = []
+        self.meta: dict = {}
+        self.book_index = BookIndex()
+        self.transaction_index = TransactionIndex()
+        self.user_directory = UserDirectory()
+        self.search_index = SearchIndex()
+        self.user_search = UserSearchIndex()
+        self.fuzzy_index = TrigramIndex()
+        self.latest_books = LatestBooks()
+        self.fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
+        self.stats = LibraryStats()
+        self.session_tokens = SessionTokens()
+        # In-memory record versions; rendered fragments are keyed on them.
+        self._book_versions: dict[str, int] = {}
+        self.migration_timings: list[tuple[str, float]] = []
+        # (hashed, total) of the last bulk hashing run at startup, for the dashboard.
+        self.bulk_hashing: tuple[int, int] | None = None
         self.load_data()
+        atexit.register(self.flush)
+        # Reservation emails are queued here and sent by the outbox's worker thread.
+        root, _ = os.path.splitext(self.data_file)
+        self.outbox = EmailOutbox(os.getenv('BOOKFLOW_OUTBOX_PATH', f"{root}.outbox.db"))
+        self.outbox.start()
+        atexit.register(self.outbox.stop)
     
     def load_data(self):
-        """Load data from JSON file"""
-        try:
-            with open(self.data_file, 'r') as f:
-                data = json.load(f)
-                self.users = data.get('users', self.get_default_users())
-                self.books = data.get('books', self.get_default_books())
-                self.transactions = data.get('transactions', [])
-                self.reservations = data.get('reservations', [])
-                self.migrate_user_contact_fields()
-                self.migrate_user_password_fields()
-                self.migrate_program_books()
-                self.migrate_user_program_fields()
-                self.seed_program_books()
-                self.seed_collection_catalog()
-                self.normalize_book_metadata()
-        except FileNotFoundError:
+        """Load data from the configured storage backend"""
+        data = self.storage.load()
+        # The hash policy must be settled before any default account is hashed.
+        self.meta = data.get('meta', {}) if data is not None else {}
+        policy_changed = self.apply_password_policy()
+        if data is not None:
+            # Defaults are only built when missing; building them hashes passwords.
+            self.users = data['users'] if 'users' in data else self.get_default_users()
+            self.books = data['books'] if 'books' in data else self.get_default_books()
+            self.transactions = data.get('transactions', [])
+            self.reservations = data.get('reservations', [])
+        else:
             self.users = self.get_default_users()
             self.books = self.get_default_books()
             self.transactions = []
             self.reservations = []
-            self.migrate_user_password_fields()
-            self.migrate_program_books()
-            self.migrate_user_program_fields()
-            self.seed_program_books()
-            self.seed_collection_catalog()
-            self.normalize_book_metadata()
+            self.save_data()
+        if policy_changed:
+            self.save_data('meta')
+        self.run_migrations()
+        self.refresh_seeded_catalogues()
+        self.book_index.rebuild(self.books)
+        self.search_index.rebuild(iter_book_rows(self.books))
+        self.fuzzy_index.rebuild(iter_book_rows(self.books))
+        self.latest_books.rebuild(self.books.get('program_books', {}))
+        self.stats.recount(self.users, self.books, self.transactions)
+        self.transaction_index.rebuild(self.transactions)
+        # Columnar copy for the admin browser; built on first query, then patched.
+        self.transaction_frame = TransactionFrame(self.transactions, self.book_index)
+        self.user_directory.rebuild(self.users)
+        self.user_search.rebuild(self.users)
+        # Migrations and seeding only mark sections dirty; write them in one go.
+        self.flush()
+
+    def apply_password_policy(self) -> bool:
+        """Reuse the PBKDF2 calibration stored in meta; True if a new one was recorded."""
+        stored = self.meta.get('password_policy')
+        calibration = load_password_policy(stored)
+        if calibration is None or calibration == stored:
+            return False
+        self.meta['password_policy'] = calibration
+        return True
+
+    def run_migrations(self):
+        """Apply the registered migrations this data file has not seen yet."""
+        current = int(self.meta.get('schema_version', 0))
+        self.migration_timings = []
+        for version, name in self.MIGRATIONS:
+            if version <= current:
+                continue
+            started = time.perf_counter()
+            getattr(self, name)()
+            elapsed = time.perf_counter() - started
+            self.migration_timings.append((name, elapsed))
+            logger.info("Migration %d (%s) took %.1f ms", version, name, elapsed * 1000)
+            self.meta['schema_version'] = version
+
+        if self.migration_timings:
+            # Some steps (e.g. normalize_book_metadata) never save on their own.
             self.save_data()
     
     def migrate_user_contact_fields(self):
@@ -1374,29 +1485,105 @@ class BookFlowApp:
                         user['email'] = 'Not provided'
                         updated = True
         if updated:
-            self.save_data()
+            self.save_data('users')
+
+    def record_hash_progress(self, done: int, total: int) -> None:
+        # Callbacks arrive from the pool's threads and may be reported out of order.
+        # Bulk hashing runs during load_data, never while a caller holds this lock.
+        with self.lock:
+            if self.bulk_hashing is None or self.bulk_hashing[1] != total or done > self.bulk_hashing[0]:
+                self.bulk_hashing = (done, total)
+        log_hash_progress(done, total)
 
     def migrate_user_password_fields(self):
         """Ensure all stored users have hashed passwords."""
-        updated = False
-        for role, users in self.users.items():
-            for user in users:
-                if ensure_password_fields(user):
-                    updated = True
+        accounts = [user for users in self.users.values() for user in users]
+        if ensure_password_fields_many(accounts, self.record_hash_progress):
+            self.save_data('users')
 
-        if updated:
-            self.save_data()
-
-    def save_data(self):
-        """Save data to JSON file"""
-        data = {
+    def _snapshot(self) -> dict:
+        return {
             'users': self.users,
             'books': self.books,
             'transactions': self.transactions,
             'reservations': self.reservations,
+            'meta': self.meta,
         }
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f, indent=4)
+
+    def save_data(self, *sections: str):
+        """Mark data sections dirty so the next flush writes them in one batch"""
+        with self.lock:
+            self._dirty.update(sections or DATA_SECTIONS)
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(SAVE_DEBOUNCE_SECONDS, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self) -> None:
+        """Write every dirty section now; called after each rerun and at shutdown."""
+        with self.lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+            sections, self._dirty = self._dirty, set()
+            try:
+                self.storage.save(self._snapshot(), sections)
+            except Exception:
+                self._dirty.update(sections)
+                raise
+
+    def record_change(self, record: dict) -> None:
+        """Persist a single mutation instead of rewriting every record."""
+        with self.lock:
+            self.storage.record(record, self._snapshot())
+
+    def add_user(self, role_key: str, user: dict) -> bool:
+        """Append a new account unless its username or ID is already taken."""
+        with self.lock:
+            if self.user_directory.username_taken(user['username'], (role_key,)) or self.user_directory.id_taken(
+                user['id'], (role_key,)
+            ):
+                return False
+            self.users.setdefault(role_key, []).append(user)
+            self.user_directory.add(role_key, user)
+            self.user_search.add(role_key, user)
+            self.stats.user_added(role_key)
+            self.save_data('users')
+            return True
+
+    def remove_user(self, role_key: str, user_id: str) -> dict | None:
+        with self.lock:
+            user = self.user_directory.by_id(user_id, (role_key,))
+            if user is None:
+                return None
+            self.users[role_key] = [u for u in self.users.get(role_key, []) if u is not user]
+            self.user_directory.remove(role_key, user)
+            self.user_search.remove(role_key, user_id)
+            self.session_tokens.revoke_user(role_key, user_id)
+            self.stats.user_removed(role_key)
+            self.save_data('users')
+            return user
+
+    def update_user(self, role_key: str, user_id: str, changes: dict) -> bool:
+        """Apply profile changes; False if a new username is taken within the role."""
+        with self.lock:
+            user = self.user_directory.by_id(user_id, (role_key,))
+            if user is None:
+                return False
+            new_username = changes.get('username', user['username'])
+            owner = self.user_directory.by_username(new_username, role_key)
+            if owner is not None and owner is not user:
+                return False
+            self.user_directory.remove(role_key, user)
+            self.user_search.remove(role_key, user_id)
+            user.update(changes)
+            ensure_password_fields(user)
+            self.user_directory.add(role_key, user)
+            self.user_search.add(role_key, user)
+            self.save_data('users')
+            return True
 
     def update_user_email(self, user_id: str, role: str, email: str | None) -> None:
         role_key = (
@@ -1407,11 +1594,13 @@ class BookFlowApp:
             else 'admin'
         )
         new_value = email.strip() if isinstance(email, str) and email.strip() else 'Not provided'
-        for user in self.users.get(role_key, []):
-            if user.get('id') == user_id:
+        with self.lock:
+            user = self.user_directory.by_id(user_id, (role_key,))
+            if user is not None:
                 user['email'] = new_value
-                break
-        self.save_data()
+                self.user_search.remove(role_key, user_id)
+                self.user_search.add(role_key, user)
+            self.record_change({'op': 'email', 'role': role_key, 'user_id': user_id, 'email': new_value})
 
     def get_active_reservation(self, user_id: str, book_id: str) -> dict | None:
         for record in self.reservations:
@@ -1424,23 +1613,24 @@ class BookFlowApp:
         return None
 
     def create_reservation(self, user: dict, book: dict) -> dict:
-        sequence = len(self.reservations) + 1
-        reservation_id = f"RSV{datetime.now().strftime('%Y%m%d%H%M%S')}{sequence:03d}"
-        reserved_at = datetime.now().strftime('%Y-%m-%d %H:%M')
-        record = {
-            'id': reservation_id,
-            'book_id': book['id'],
-            'book_title': book.get('title'),
-            'programme': book.get('programme'),
-            'user_id': user.get('id'),
-            'user_name': user.get('name'),
-            'user_email': user.get('email'),
-            'status': 'waiting',
-            'reserved_at': reserved_at,
-        }
-        self.reservations.append(record)
-        self.save_data()
-        return record
+        with self.lock:
+            sequence = len(self.reservations) + 1
+            reservation_id = f"RSV{datetime.now().strftime('%Y%m%d%H%M%S')}{sequence:03d}"
+            reserved_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+            record = {
+                'id': reservation_id,
+                'book_id': book['id'],
+                'book_title': book.get('title'),
+                'programme': book.get('programme'),
+                'user_id': user.get('id'),
+                'user_name': user.get('name'),
+                'user_email': user.get('email'),
+                'status': 'waiting',
+                'reserved_at': reserved_at,
+            }
+            self.reservations.append(record)
+            self.record_change({'op': 'reserve', 'reservation': record})
+            return record
 
     def get_default_users(self):
         default_programme = all_programmes()[0] if all_programmes() else 'General Library'
@@ -1465,24 +1655,19 @@ class BookFlowApp:
         admin_contact = os.getenv('BOOKFLOW_ADMIN_CONTACT', 'Not provided')
         admin_email = os.getenv('BOOKFLOW_ADMIN_EMAIL', 'Not provided')
 
-        admin_hash, admin_salt = hash_password(admin_password)
         defaults['admin'] = [{
             'id': os.getenv('BOOKFLOW_ADMIN_ID', 'ADMIN001'),
             'username': admin_username,
-            'password_hash': admin_hash,
-            'password_salt': admin_salt,
+            'password': admin_password,
             'name': os.getenv('BOOKFLOW_ADMIN_NAME', 'Administrator'),
             'contact': admin_contact,
             'email': admin_email
         }]
 
-        for role_users in defaults.values():
-            for user in role_users:
-                if 'password' in user:
-                    password_hash, password_salt = hash_password(user['password'])
-                    user['password_hash'] = password_hash
-                    user['password_salt'] = password_salt
-                    user.pop('password', None)
+        # Every default account, the admin included, is hashed in one reported batch.
+        ensure_password_fields_many(
+            (user for role_users in defaults.values() for user in role_users), self.record_hash_progress
+        )
 
         return defaults
     
@@ -1530,11 +1715,43 @@ class BookFlowApp:
                 updated = True
 
         if updated:
-            self.save_data()
+            self.save_data('users')
+
+    def refresh_seeded_catalogues(self):
+        """Re-seed only the programmes and collections whose templates changed."""
+        catalog_hash = default_catalog_hash()
+        stored = self.meta.setdefault('seed_fingerprints', {})
+        if stored.get('catalog') == catalog_hash:
+            return
 
-    def seed_program_books(self):
+        current = default_seed_fingerprints()
+        stored_programmes = stored.get('programmes', {})
+        stored_collections = stored.get('collections', {})
+        changed_programmes = [
+            name for name, digest in current['programmes'].items() if stored_programmes.get(name) != digest
+        ]
+        changed_collections = [
+            name for name, digest in current['collections'].items() if stored_collections.get(name) != digest
+        ]
+        if changed_programmes:
+            self.seed_program_books(changed_programmes)
+        if changed_collections:
+            self.seed_collection_catalog(changed_collections)
+
+        stored['catalog'] = catalog_hash
+        self.save_data('meta')
+
+    def _store_seed_fingerprints(self, kind: str, names) -> None:
+        current = default_seed_fingerprints()[kind]
+        stored = self.meta.setdefault('seed_fingerprints', {}).setdefault(kind, {})
+        for name in current if names is None else names:
+            if name in current:
+                stored[name] = current[name]
+        self.save_data('meta')
+
+    def seed_program_books(self, programmes: list[str] | None = None):
         program_books = self.books.setdefault('program_books', {})
-        defaults = build_default_program_books()
+        defaults = build_default_program_books(programmes)
         seeded = False
 
         for programme, default_books in defaults.items():
@@ -1581,36 +1798,40 @@ class BookFlowApp:
                             seeded = True
 
         # ensure general library defaults exist
-        general_books = program_books.setdefault('General Library', [])
-        if len(general_books) < len(GENERAL_LIBRARY_BOOKS):
-            existing_ids = {b['id'] for b in general_books}
-            for book in GENERAL_LIBRARY_BOOKS:
-                if book['id'] not in existing_ids:
-                    entry = dict(book)
-                    entry['available'] = entry.get('copies', 1)
-                    entry['programme'] = 'General Library'
-                    entry['program_category'] = 'General'
-                    entry['catalog_type'] = 'program'
-                    general_books.append(entry)
-                    seeded = True
-        else:
-            general_map = {book['id']: book for book in GENERAL_LIBRARY_BOOKS}
-            for book in general_books:
-                template = general_map.get(book['id'])
-                if not template:
-                    continue
-                if template.get('pdf_url') and not book.get('pdf_url'):
-                    book['pdf_url'] = template['pdf_url']
-                if template.get('copies') and book.get('copies', 0) < template['copies']:
-                    book['copies'] = template['copies']
-                    book['available'] = min(book.get('available', template['copies']), template['copies'])
-
+        if programmes is None or 'General Library' in programmes:
+            general_books = program_books.setdefault('General Library', [])
+            if len(general_books) < len(GENERAL_LIBRARY_BOOKS):
+                existing_ids = {b['id'] for b in general_books}
+                for book in GENERAL_LIBRARY_BOOKS:
+                    if book['id'] not in existing_ids:
+                        entry = dict(book)
+                        entry['available'] = entry.get('copies', 1)
+                        entry['programme'] = 'General Library'
+                        entry['program_category'] = 'General'
+                        entry['catalog_type'] = 'program'
+                        general_books.append(entry)
+                        seeded = True
+            else:
+                general_map = {book['id']: book for book in GENERAL_LIBRARY_BOOKS}
+                for book in general_books:
+                    template = general_map.get(book['id'])
+                    if not template:
+                        continue
+                    if template.get('pdf_url') and not book.get('pdf_url'):
+                        book['pdf_url'] = template['pdf_url']
+                        seeded = True
+                    if template.get('copies') and book.get('copies', 0) < template['copies']:
+                        book['copies'] = template['copies']
+                        book['available'] = min(book.get('available', template['copies']), template['copies'])
+                        seeded = True
+
+        self._store_seed_fingerprints('programmes', programmes)
         if seeded:
-            self.save_data()
+            self.save_data('books')
 
-    def seed_collection_catalog(self):
+    def seed_collection_catalog(self, collections: list[str] | None = None):
         catalog = self.books.setdefault('collection_catalog', {})
-        defaults = build_collection_catalog()
+        defaults = build_collection_catalog(collections)
         updated = False
 
         for name, default_items in defaults.items():
@@ -1663,8 +1884,9 @@ class BookFlowApp:
                 item['catalog_type'] = 'collection'
                 item['collection'] = name
 
+        self._store_seed_fingerprints('collections', collections)
         if updated:
-            self.save_data()
+            self.save_data('books')
 
     def normalize_book_metadata(self):
         program_books = self.books.get('program_books', {})
@@ -1722,6 +1944,69 @@ class BookFlowApp:
             book['copies'] = copies
             book['available'] = min(max(int(available), 0), copies)
 
+    def book_version(self, book: dict) -> int:
+        return self._book_versions.get(book_key(book), 0)
+
+    def touch_book(self, book: dict) -> None:
+        """Bump a record's version so cached fragments of it are re-rendered."""
+        key = book_key(book)
+        self._book_versions[key] = self._book_versions.get(key, 0) + 1
+
+    def library_stats(self) -> LibraryStats:
+        """Dashboard counters, recounted from the raw data when they are due a drift check."""
+        with self.lock:
+            if time.monotonic() - self.stats.last_recount >= STATS_RECOUNT_SECONDS:
+                drift = self.stats.recount(self.users, self.books, self.transactions)
+                if drift:
+                    logger.warning("Dashboard counters drifted and were recounted: %s", drift)
+            return self.stats
+
+    def find_book(self, book_id: str, location=None) -> dict | None:
+        """O(1) lookup of a book in any catalogue."""
+        return self.book_index.get(book_id, location)
+
+    def _book_list(self, location) -> list[dict]:
+        catalog, name = location
+        if catalog == 'program':
+            return self.books.setdefault('program_books', {}).setdefault(name, [])
+        if catalog == 'collection':
+            return self.books.setdefault('collection_catalog', {}).setdefault(name, [])
+        return self.books.setdefault('teacher_books', [])
+
+    def add_book(self, book: dict) -> bool:
+        """Add a book to the catalogue its metadata points at; False if the id is taken there."""
+        location = book_location(book)
+        with self.lock:
+            if self.book_index.get(book['id'], location) is not None:
+                return False
+            book.setdefault('added_at', datetime.now().isoformat(timespec='seconds'))
+            self.touch_book(book)
+            self._book_list(location).append(book)
+            self.book_index.add(book, location)
+            self.search_index.add(book, location)
+            self.fuzzy_index.add(book, location)
+            self.stats.book_added(location)
+            if location[0] == 'program':
+                self.latest_books.add(location[1], book)
+            self.save_data('books')
+            return True
+
+    def remove_book(self, book_id: str, location) -> dict | None:
+        with self.lock:
+            book = self.book_index.remove(book_id, location)
+            if book is None:
+                return None
+            self.search_index.remove(book_id, location)
+            self.touch_book(book)
+            self.fuzzy_index.remove(book_id, location)
+            self.stats.book_removed(location)
+            if location[0] == 'program':
+                self.latest_books.remove(location[1], book)
+            books = self._book_list(location)
+            books[:] = [b for b in books if b is not book]
+            self.save_data('books')
+            return book
+
     def get_program_books(self, programme: str) -> list[dict]:
         return self.books.get('program_books', {}).get(programme, [])
 
@@ -1733,22 +2018,43 @@ class BookFlowApp:
     def verify_login(self, username, password, role):
         """Verify user credentials"""
         role_key = 'students' if role == 'student' else 'teachers' if role == 'teacher' else 'admin'
-        users = self.users.get(role_key, [])
-
-        
-        for user in users:
-            if user['username'] == username and verify_password(password, user.get('password_hash'), user.get('password_salt')):
-                return user
+        user = self.user_directory.by_username(username, role_key)
+        # Usernames are matched exactly at login; the directory key is case-folded.
+        if user and user['username'] == username and verify_user_password(user, password):
+            if needs_rehash(user):
+                # Upgrade the stored hash to the current policy while the plaintext is at hand.
+                self.update_user(role_key, user['id'], hash_password_record(password))
+            elif not user.get('password_iterations'):
+                # A legacy hash that already meets the policy only needs its parameters recorded.
+                self.update_user(role_key, user['id'], hash_parameter_fields(user))
+            return user
         return None
 
-# Initialize app
-if 'app' not in st.session_state:
-    st.session_state.app = BookFlowApp()
-elif not (
-    hasattr(st.session_state.app, 'get_active_reservation')
-    and hasattr(st.session_state.app, 'create_reservation')
-):
-    st.session_state.app = BookFlowApp()
+    def start_session(self, role: str, user: dict, binding: str = '') -> str:
+        """Issue the session token a browser presents to skip logging in again."""
+        return self.session_tokens.issue(ROLE_KEYS[role], user['id'], binding)
+
+    def resume_session(self, token: str, binding: str = '') -> tuple[str, dict] | None:
+        """``(role, user)`` for a live session token, without checking the password again."""
+        session = self.session_tokens.validate(token, binding)
+        if session is None:
+            return None
+        role_key, user_id = session
+        user = self.user_directory.by_id(user_id, (role_key,))
+        if user is None:
+            self.session_tokens.revoke(token)
+            return None
+        role = next(role for role, key in ROLE_KEYS.items() if key == role_key)
+        return role, user
+
+@st.cache_resource
+def get_library() -> BookFlowApp:
+    """Build the library once per server process and share it across sessions."""
+    return BookFlowApp()
+
+
+# Initialize app: session_state only references the shared library, it never copies it.
+st.session_state.app = get_library()
 
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -1756,6 +2062,37 @@ if 'logged_in' not in st.session_state:
     st.session_state.role = None
     st.session_state.selected_program = None
 
+# A refresh or reconnect starts a new session; pick the login back up from its cookie.
+if not st.session_state.logged_in and st.context.cookies.get(SESSION_COOKIE):
+    token = st.context.cookies[SESSION_COOKIE]
+    resumed = st.session_state.app.resume_session(token, session_binding())
+    if resumed:
+        st.session_state.role, st.session_state.user = resumed
+        st.session_state.logged_in = True
+        st.session_state.session_token = token
+        st.session_state.selected_program = (
+            st.session_state.user.get('programme') if st.session_state.role == 'student' else None
+        )
+    elif st.session_state.get('session_token') != token:
+        # Remember the dead token so the cookie is cleared only once per session.
+        st.session_state.session_token = token
+        st.session_state.session_cookie = ('', 0)
+
+
+def logout():
+    """Revoke the session token, clear its cookie and return to the login page."""
+    token = st.session_state.pop('session_token', None)
+    if token:
+        st.session_state.app.session_tokens.revoke(token)
+        st.session_state.session_cookie = ('', 0)
+    st.session_state.logged_in = False
+    st.session_state.user = None
+    st.session_state.role = None
+    st.session_state.selected_program = None
+    st.session_state.page = 'login'
+    st.rerun()
+
+
 def login_page():
     """Display login page"""
     # Hero section with gradient - compact
@@ -1809,6 +2146,7 @@ def login_page():
                         st.session_state.selected_program = (
                             user.get('programme') if st.session_state.role == 'student' else None
                         )
+                        begin_session(st.session_state.role, user)
                         st.success(f"✅ Welcome back, {user['name']}!")
                         st.balloons()
                         st.rerun()
@@ -1880,39 +2218,144 @@ def register_page():
                     
                     # Check if username or ID exists
                     role_key = 'students' if role == 'Student' else 'teachers'
-                    existing_users = st.session_state.app.users.get(role_key, [])
+                    directory = st.session_state.app.user_directory
                     
-                    if any(u['username'].lower() == username.lower() for u in existing_users):
+                    if directory.username_taken(username, (role_key,)):
                         st.error("❌ Username already exists!")
-                    elif any(u['id'] == user_id for u in existing_users):
+                    elif directory.id_taken(user_id, (role_key,)):
                         st.error("❌ ID already exists!")
                     else:
                         # Create new user with hashed password
-                        password_hash, password_salt = hash_password(password)
                         new_user = {
                             'id': user_id,
                             'username': username,
-                            'password_hash': password_hash,
-                            'password_salt': password_salt,
+                            **hash_password_record(password),
                             'name': name,
                             'contact': contact if contact else 'Not provided',
                             'email': email if email else 'Not provided'
                         }
 
-                        if role_key not in st.session_state.app.users:
-                            st.session_state.app.users[role_key] = []
-                        
-                        st.session_state.app.users[role_key].append(new_user)
-                        st.session_state.app.save_data()
-                        
-                        st.success(f"✅ Account created successfully! You can now login with username: {username}")
-                        st.balloons()
+                        if st.session_state.app.add_user(role_key, new_user):
+                            st.success(f"✅ Account created successfully! You can now login with username: {username}")
+                            st.balloons()
+                        else:
+                            st.error("❌ Username or ID already exists!")
         
         with col_b:
             if st.button("← Back to Login", use_container_width=True):
                 st.session_state.page = 'login'
                 st.rerun()
 
+BOOK_GRID_CSS = """
+<style>
+.bf-grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(280px, 1fr)); gap: 0.8rem; margin: 0.5rem 0 1rem 0; }
+.bf-card { background: #1e1e1e; padding: 1rem; border-radius: 10px; box-shadow: 0 2px 4px rgba(0,0,0,0.3);
+           border-left: 4px solid var(--bf-status); display: flex; flex-direction: column; gap: 0.6rem; }
+.bf-card.available { --bf-status: #28a745; }
+.bf-card.unavailable { --bf-status: #dc3545; }
+.bf-card.reference { --bf-status: #17a2b8; }
+.bf-card h3 { color: #ffffff; margin: 0; font-size: 1.05rem; }
+.bf-card p { margin: 0; }
+.bf-author { color: #b0b0b0; font-size: 0.9rem; }
+.bf-meta { color: #888888; font-size: 0.8rem; }
+.bf-card a { color: #4facfe; font-size: 0.8rem; }
+.bf-status { display: flex; justify-content: space-between; align-items: center; margin-top: auto; }
+.bf-badge { background: var(--bf-status); color: white; padding: 0.3rem 0.7rem; border-radius: 8px;
+            font-weight: 600; font-size: 0.8rem; }
+.bf-copies { color: #ffffff; font-weight: 600; }
+.bf-copies small { color: #888888; font-weight: 400; }
+</style>
+"""
+
+
+def book_card_html(book: dict) -> str:
+    """Markup for one catalogue card; styling comes from BOOK_GRID_CSS."""
+    available = int(book.get('available', 0))
+    copies = int(book.get('copies', 0))
+    if not book.get('borrowable', True):
+        status_class, status_label = "reference", "📖 Reference Only"
+    elif available > 0:
+        status_class, status_label = "available", "✅ Available"
+    else:
+        status_class, status_label = "unavailable", "❌ Not Available"
+
+    meta = [f"🆔 {book.get('id')}"]
+    for icon, field in (("🎓", 'program_category'), ("🏷️", 'programme'), ("📄", 'format'),
+                        ("🗓️", 'issue_date'), ("📚", 'collection')):
+        if book.get(field):
+            meta.append(f"{icon} {book[field]}")
+    pdf_url = book.get('pdf_url')
+    pdf_html = ""
+    if isinstance(pdf_url, str) and pdf_url.strip():
+        pdf_html = f"<a href='{html.escape(pdf_url.strip())}' target='_blank'>🔗 Read / Download</a>"
+
+    return (
+        f"<div class='bf-card {status_class}'>"
+        f"<h3>📖 {html.escape(str(book.get('title')))}</h3>"
+        f"<p class='bf-author'>✍️ {html.escape(str(book.get('author', 'Unknown')))}</p>"
+        f"<p class='bf-meta'>{html.escape(' • '.join(meta))}</p>"
+        f"{pdf_html}"
+        f"<div class='bf-status'><span class='bf-badge'>{status_label}</span>"
+        f"<span class='bf-copies'>{available}/{copies} <small>copies</small></span></div>"
+        "</div>"
+    )
+
+
+def cached_book_card_html(book: dict) -> str:
+    app = st.session_state.app
+    key = ('card', book_key(book), app.book_version(book), book.get('available'))
+    return app.fragment_cache.get_or_render(key, lambda: book_card_html(book))
+
+
+def book_grid_html(books: list[dict]) -> str:
+    """A whole page of cards as one HTML payload."""
+    return BOOK_GRID_CSS + "<div class='bf-grid'>" + "".join(cached_book_card_html(book) for book in books) + "</div>"
+
+
+def carousel_slide_html(book: dict, current: int, total: int) -> str:
+    """Markup for one "latest books" slide, served from the fragment cache."""
+    app = st.session_state.app
+    key = ('slide', book_key(book), app.book_version(book), book.get('available'), current, total)
+    return app.fragment_cache.get_or_render(key, lambda: _render_carousel_slide(book, current, total))
+
+
+def _render_carousel_slide(book: dict, current: int, total: int) -> str:
+    availability_badge = (
+        "<span style='background: rgba(40,167,69,0.15); color: #28a745; padding: 0.2rem 0.5rem; border-radius: 999px; font-size: 0.7rem;'>"
+        f"{book['available']} / {book['copies']} Available"
+        "</span>"
+    )
+    pdf_url = book.get('pdf_url')
+    pdf_link = (
+        "<a href='{url}' target='_blank' style='color:#ffe066; text-decoration:none;'>📄 Download</a>"
+    ).replace('{url}', pdf_url.strip()) if isinstance(pdf_url, str) and pdf_url.strip() else ""
+
+    return """
+        <div style='background: #111111; border-radius: 12px; padding: 1.5rem; margin: 0.8rem 0; box-shadow: 0 8px 16px rgba(0,0,0,0.35);'>
+            <div style='display:flex; flex-direction:column; gap:0.6rem;'>
+                <div style='display:flex; justify-content:space-between; align-items:center; flex-wrap:wrap; gap:0.6rem;'>
+                    <span style='color: rgba(255,255,255,0.6); font-size: 0.75rem;'>Slide {current}/{total}</span>
+                    {availability}
+                </div>
+                <h2 style='color:#ffffff; margin:0; font-size:1.4rem;'>{title}</h2>
+                <p style='color: rgba(255,255,255,0.7); margin:0; font-size:0.9rem;'>✍️ {author}</p>
+                <div style='display:flex; justify-content:space-between; align-items:center; flex-wrap:wrap; gap:0.5rem;'>
+                    <span style='color: rgba(255,255,255,0.5); font-size:0.8rem;'>🆔 {book_id}</span>
+                    {pdf}
+                </div>
+            </div>
+        </div>
+        """.format(
+        current=current,
+        total=total,
+        availability=availability_badge,
+        title=book['title'],
+        author=book['author'],
+        book_id=book['id'],
+        pdf=pdf_link,
+    )
+
+
 def show_books_page():
     """Display books catalog with programme and special collections."""
 
@@ -1927,21 +2370,14 @@ def show_books_page():
             if reservation_id:
                 base_message += f" (ID: {reservation_id})"
 
-            if email_status == 'sent' and email_address:
-                st.success(f"{base_message}. Confirmation email sent to **{email_address}**.")
-            elif email_status == 'failed':
-                error_detail = reserve_info.get('email_error')
-                detail_suffix = f" Reason: {error_detail}" if error_detail else ''
-                st.warning(f"{base_message}. Email notification could not be delivered.{detail_suffix}")
+            if email_status == 'queued' and email_address:
+                st.success(f"{base_message}. A confirmation email to **{email_address}** is on its way.")
+            elif email_status == 'unconfigured':
+                st.info(f"{base_message}. Email notifications are not set up, so no confirmation email was sent.")
+                st.caption(reserve_info.get('email_error'))
             else:
                 st.info(base_message)
 
-        if st.session_state.get('show_borrow_success', False):
-            show_borrow_celebration()
-
-        if st.session_state.get('show_return_success', False):
-            show_return_celebration(st.session_state.get('return_on_time', True))
-
     def render_header(title: str, subtitle: str):
         st.markdown(
             f"""
@@ -1956,7 +2392,7 @@ def show_books_page():
             unsafe_allow_html=True,
         )
 
-    def render_book_cards(book_list: list[dict]):
+    def render_book_cards(book_list: list[dict], location):
         if not book_list:
             st.info("📭 No titles available in this view yet!")
             return
@@ -1965,133 +2401,139 @@ def show_books_page():
         with col_search:
             search = st.text_input(
                 "🔍 Search books",
-                placeholder="Search by title or author...",
+                placeholder="Search by title, author or format...",
                 label_visibility="collapsed",
             )
         with col_filter:
             st.write("")
 
         if search:
-            term = search.lower()
-            book_list = [
-                b
-                for b in book_list
-                if term in b.get('title', '').lower() or term in b.get('author', '').lower()
-            ]
+            book_list = st.session_state.app.search_index.search(search, location)
+            if not book_list:
+                book_list = st.session_state.app.fuzzy_index.search(search, location)
+                if book_list:
+                    st.caption(f"No exact matches for “{search}” — showing the closest titles and authors.")
+
+        render_card_list(book_list, f"{location[0]}:{location[1]}", search)
+
+    def render_pager(total: int, view_key: str, filter_token) -> slice:
+        """Page navigation for ``total`` cards; returns the slice to render.
+
+        The page resets whenever ``filter_token`` (search text, facet) or the
+        page size changes.
+        """
+        page_key = f"book_page_{view_key}"
+        token_key = f"book_page_token_{view_key}"
+        page_size = st.session_state.get('book_page_size', BOOK_PAGE_SIZES[0])
+        if st.session_state.get(token_key) != (filter_token, page_size):
+            st.session_state[token_key] = (filter_token, page_size)
+            st.session_state[page_key] = 0
+
+        pages = max((total + page_size - 1) // page_size, 1)
+        page = min(max(st.session_state.get(page_key, 0), 0), pages - 1)
+        st.session_state[page_key] = page
+
+        def turn_page(delta: int):
+            # Runs before the rerun, so the buttons below render the new page state.
+            st.session_state[page_key] = page + delta
+
+        col_prev, col_info, col_size, col_next = st.columns([1, 2, 1, 1])
+        with col_prev:
+            st.button(
+                "◀ Prev",
+                key=f"prev_{page_key}",
+                use_container_width=True,
+                disabled=page == 0,
+                on_click=turn_page,
+                args=(-1,),
+            )
+        with col_next:
+            st.button(
+                "Next ▶",
+                key=f"next_{page_key}",
+                use_container_width=True,
+                disabled=page >= pages - 1,
+                on_click=turn_page,
+                args=(1,),
+            )
+        with col_size:
+            st.selectbox(
+                "Per page",
+                BOOK_PAGE_SIZES,
+                key='book_page_size',
+                label_visibility="collapsed",
+            )
+        start = page * page_size
+        with col_info:
+            st.markdown(
+                f"<p style='color: #6C0345; font-weight: 600; margin: 0.5rem 0;'>Found {total} item(s) • "
+                f"showing {start + 1}–{min(start + page_size, total)} • page {page + 1} of {pages}</p>",
+                unsafe_allow_html=True,
+            )
+        return slice(start, start + page_size)
 
+    @st.fragment(key=BOOK_CARDS_FRAGMENT)
+    def render_card_list(book_list: list[dict], view_key: str, filter_token=None):
+        """Pager, actions and grid; their interactions rerun only this fragment."""
         if not book_list:
             st.info("📭 No books found matching your search!")
             return
 
-        st.markdown(
-            f"<p style='color: #6C0345; font-weight: 600; margin: 1rem 0;'>Found {len(book_list)} item(s)</p>",
-            unsafe_allow_html=True,
-        )
-
-        for book in book_list:
-            is_borrowable = bool(book.get('borrowable', True))
-            available = int(book.get('available', 0))
-            copies = int(book.get('copies', 0))
-            status_color = "#28a745" if available > 0 else "#dc3545"
-            status_text = "Available" if available > 0 else "Not Available"
-            status_icon = "✅" if available > 0 else "❌"
-            if not is_borrowable:
-                status_color = "#17a2b8"
-                status_text = "Reference Only"
-                status_icon = "📖"
-
-            extra_meta = []
-            if book.get('program_category'):
-                extra_meta.append(f"🎓 {book['program_category']}")
-            if book.get('programme'):
-                extra_meta.append(f"🏷️ {book['programme']}")
-            if book.get('format'):
-                extra_meta.append(f"📄 {book['format']}")
-            if book.get('issue_date'):
-                extra_meta.append(f"🗓️ {book['issue_date']}")
-            if book.get('collection'):
-                extra_meta.append(f"📚 {book['collection']}")
-
-            meta_html = """<p style='color: #888888; margin: 0; font-size: 0.8rem;'>""" + " • ".join(extra_meta) + "</p>" if extra_meta else ""
-
-            pdf_url = book.get('pdf_url')
-            pdf_html = ""
-            if isinstance(pdf_url, str) and pdf_url.strip():
-                pdf_html = (
-                    "<p style='color: #4facfe; margin: 0.4rem 0 0 0; font-size: 0.8rem;'>"
-                    "🔗 <a style='color: #4facfe;' href='{url}' target='_blank'>Read / Download</a>"
-                    "</p>"
-                ).format(url=pdf_url.strip())
-
-            st.markdown(
-                f"""
-                <div style='background: #1e1e1e; padding: 1rem; border-radius: 10px; 
-                            margin: 0.5rem 0; box-shadow: 0 2px 4px rgba(0,0,0,0.3);
-                            border-left: 4px solid {status_color};
-                            transition: all 0.3s ease;'>
-                    <div style='display: flex; flex-wrap: wrap; justify-content: space-between; align-items: center; gap: 1rem;'>
-                        <div style='flex: 1; min-width: 220px;'>
-                            <h3 style='color: #ffffff; margin: 0 0 0.3rem 0; font-size: 1.15rem;'>📖 {book.get('title')}</h3>
-                            <p style='color: #b0b0b0; margin: 0 0 0.2rem 0; font-size: 0.9rem;'>✍️ {book.get('author', 'Unknown')}</p>
-                            <p style='color: #888888; margin: 0; font-size: 0.8rem;'>🆔 {book.get('id')}</p>
-                            {meta_html}
-                            {pdf_html}
-                        </div>
-                        <div style='text-align: center; padding: 0 1rem; min-width: 120px;'>
-                            <div style='background: {status_color}; color: white; padding: 0.4rem 0.8rem; 
-                                        border-radius: 8px; font-weight: 600; font-size: 0.85rem;'>
-                                {status_icon} {status_text}
-                            </div>
-                            <p style='margin: 0.4rem 0 0 0; font-size: 1.1rem; font-weight: 600; color: #ffffff;'>
-                                {available}/{copies}
-                            </p>
-                            <p style='margin: 0; font-size: 0.75rem; color: #888888;'>Copies</p>
-                        </div>
-                    </div>
-                </div>
-                """,
-                unsafe_allow_html=True,
+        # Only the current page is rendered, so rerun cost follows the page size.
+        page_books = book_list[render_pager(len(book_list), view_key, filter_token)]
+        render_card_actions(page_books, view_key)
+        st.markdown(book_grid_html(page_books), unsafe_allow_html=True)
+
+        # A borrow confirmed in its dialog reruns this fragment to refresh the
+        # counts; re-open the dialog so it can show the outcome.
+        reopen = st.session_state.pop('reopen_card_dialog', None)
+        if reopen:
+            kind, key = reopen
+            book = next((b for b in page_books if book_key(b) == key), None)
+            if book is not None:
+                dict(CARD_MODALS)[kind](book)
+
+    def render_card_actions(page_books: list[dict], view_key: str):
+        """One title picker and one set of action buttons for the whole page."""
+        books_by_key = {book_key(book): book for book in page_books}
+        col_pick, col_borrow, col_who, col_details = st.columns([3, 1, 1, 1])
+        with col_pick:
+            selected_key = st.selectbox(
+                "Select a title",
+                list(books_by_key),
+                format_func=lambda key: f"📖 {books_by_key[key].get('title')} — {books_by_key[key].get('id')}",
+                key=f"card_select_{view_key}",
+                label_visibility="collapsed",
             )
+        book = books_by_key.get(selected_key)
+        if book is None:
+            return
 
-            action_cols = st.columns(3)
-
-            with action_cols[0]:
-                if is_borrowable:
-                    if st.button(
-                        "📥 Borrow",
-                        key=f"borrow_{book['id']}",
-                        use_container_width=True,
-                        disabled=available <= 0,
-                    ):
-                        st.session_state[f"show_borrow_{book['id']}"] = True
-                else:
-                    st.button(
-                        "📖 Read", key=f"read_{book['id']}", use_container_width=True, disabled=not pdf_url
-                    )
-
-            with action_cols[1]:
-                if st.button(
-                    "👥 Who Has?",
-                    key=f"who_{book['id']}",
-                    use_container_width=True,
-                    disabled=not is_borrowable,
-                ):
-                    st.session_state[f"show_who_{book['id']}"] = True
-
-            with action_cols[2]:
-                if st.button(
-                    "ℹ️ Details",
-                    key=f"details_{book['id']}",
-                    use_container_width=True,
-                ):
-                    st.session_state[f"show_details_{book['id']}"] = True
-
-            if st.session_state.get(f"show_borrow_{book['id']}", False):
-                show_borrow_modal(book)
-            if st.session_state.get(f"show_who_{book['id']}", False):
-                show_who_has_modal(book)
-            if st.session_state.get(f"show_details_{book['id']}", False):
-                show_details_modal(book)
+        def open_modal(kind: str):
+            # Dialogs are opened straight from this fragment run; no page rerun needed.
+            st.session_state.pop(f"details_borrow_{selected_key}", None)
+            dict(CARD_MODALS)[kind](book)
+
+        is_borrowable = bool(book.get('borrowable', True))
+        with col_borrow:
+            if st.button(
+                "📥 Borrow",
+                key=f"borrow_{view_key}",
+                use_container_width=True,
+                disabled=not is_borrowable or int(book.get('available', 0)) <= 0,
+            ):
+                open_modal('borrow')
+        with col_who:
+            if st.button(
+                "👥 Who Has?",
+                key=f"who_{view_key}",
+                use_container_width=True,
+                disabled=not is_borrowable,
+            ):
+                open_modal('who')
+        with col_details:
+            if st.button("ℹ️ Details", key=f"details_{view_key}", use_container_width=True):
+                open_modal('details')
 
             st.markdown("<br>", unsafe_allow_html=True)
 
@@ -2138,8 +2580,9 @@ def show_books_page():
                 if programmes and st.button("Set Programme", type="primary"):
                     st.session_state.selected_program = selected_programme
                     if selected_programme:
-                        st.session_state.user['programme'] = selected_programme
-                        st.session_state.app.save_data()
+                        with st.session_state.app.lock:
+                            st.session_state.user['programme'] = selected_programme
+                            st.session_state.app.save_data('users')
                     st.rerun()
 
             active_program = st.session_state.selected_program
@@ -2180,43 +2623,7 @@ def show_books_page():
                     st.rerun()
 
             with col_card:
-                availability_badge = (
-                    "<span style='background: rgba(40,167,69,0.15); color: #28a745; padding: 0.2rem 0.5rem; border-radius: 999px; font-size: 0.7rem;'>"
-                    f"{current_book['available']} / {current_book['copies']} Available"
-                    "</span>"
-                )
-                pdf_url = current_book.get('pdf_url')
-                pdf_link = (
-                    "<a href='{url}' target='_blank' style='color:#ffe066; text-decoration:none;'>📄 Download</a>"
-                ).replace('{url}', pdf_url.strip()) if isinstance(pdf_url, str) and pdf_url.strip() else ""
-
-                st.markdown(
-                    """
-                    <div style='background: #111111; border-radius: 12px; padding: 1.5rem; margin: 0.8rem 0; box-shadow: 0 8px 16px rgba(0,0,0,0.35);'>
-                        <div style='display:flex; flex-direction:column; gap:0.6rem;'>
-                            <div style='display:flex; justify-content:space-between; align-items:center; flex-wrap:wrap; gap:0.6rem;'>
-                                <span style='color: rgba(255,255,255,0.6); font-size: 0.75rem;'>Slide {current}/{total}</span>
-                                {availability}
-                            </div>
-                            <h2 style='color:#ffffff; margin:0; font-size:1.4rem;'>{title}</h2>
-                            <p style='color: rgba(255,255,255,0.7); margin:0; font-size:0.9rem;'>✍️ {author}</p>
-                            <div style='display:flex; justify-content:space-between; align-items:center; flex-wrap:wrap; gap:0.5rem;'>
-                                <span style='color: rgba(255,255,255,0.5); font-size:0.8rem;'>🆔 {book_id}</span>
-                                {pdf}
-                            </div>
-                        </div>
-                    </div>
-                    """.format(
-                        current=current_index + 1,
-                        total=total,
-                        availability=availability_badge,
-                        title=current_book['title'],
-                        author=current_book['author'],
-                        book_id=current_book['id'],
-                        pdf=pdf_link,
-                    ),
-                    unsafe_allow_html=True,
-                )
+                st.markdown(carousel_slide_html(current_book, current_index + 1, total), unsafe_allow_html=True)
 
             with col_next:
                 st.write("")
@@ -2226,7 +2633,7 @@ def show_books_page():
 
             st.markdown("<hr style='margin: 0.5rem 0 1rem 0; border: 0; border-top: 1px solid rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
 
-        render_book_cards(book_list)
+        render_book_cards(book_list, ('program', active_program))
 
     def render_collection_view():
         catalog = collection_catalog()
@@ -2248,7 +2655,43 @@ def show_books_page():
             f"{active_collection} Collection",
             "Special resources, magazines, and reference material",
         )
-        render_book_cards(items)
+        render_book_cards(items, ('collection', active_collection))
+
+    def render_global_search():
+        index = st.session_state.app.search_index
+        query = st.text_input(
+            "🔍 Search the whole library",
+            placeholder="Title, author, programme, collection or format...",
+            key="global_search",
+        )
+        if query:
+            keys = index.search_keys(query)
+            if not keys:
+                keys = st.session_state.app.fuzzy_index.search_keys(query)
+                if keys:
+                    st.caption(f"No exact matches for “{query}” — showing the closest titles and authors.")
+        else:
+            keys = None
+
+        counts = index.facet_counts(keys)
+        facets = sorted(counts, key=lambda facet: (facet[0] != 'category', facet[1]))
+        labels = {facet: f"{'🎓' if facet[0] == 'category' else '📚'} {facet[1]} ({counts[facet]})" for facet in facets}
+        total = sum(counts.values())
+        selected = st.sidebar.selectbox(
+            "Filter results",
+            [None] + facets,
+            format_func=lambda facet: f"All ({total})" if facet is None else labels[facet],
+            key="global_search_facet",
+        )
+
+        if keys is None:
+            st.info(f"📚 {total} titles across every programme, teacher shelf and special collection. Start typing to search.")
+            return
+        if selected is not None:
+            keys = [key for key in keys if index.facet(key) == selected]
+        # A book removed by another session since the search simply drops out.
+        books = [book for book in map(index.get, keys) if book is not None]
+        render_card_list(books, 'global', (query, selected))
 
     render_flash_banner()
 
@@ -2258,10 +2701,11 @@ def show_books_page():
     with st.sidebar:
         st.markdown("---")
         st.markdown("**Catalog View**")
+        nav_options = ["Programmes", "Special Collections", "Search Library"]
         st.session_state.books_nav = st.radio(
             "",
-            ["Programmes", "Special Collections"],
-            index=0 if st.session_state.books_nav == 'Programmes' else 1,
+            nav_options,
+            index=nav_options.index(st.session_state.books_nav) if st.session_state.books_nav in nav_options else 0,
             label_visibility="collapsed",
         )
 
@@ -2271,12 +2715,45 @@ def show_books_page():
             "Browse books tailored to each academic programme",
         )
         render_programme_view()
+    elif st.session_state.books_nav == 'Search Library':
+        render_header(
+            "🔍 Library Search",
+            "Every programme, the General Library, teacher books and special collections",
+        )
+        render_global_search()
     else:
         render_collection_view()
 
 @st.dialog("📥 Borrow Book")
 def show_borrow_modal(book):
     """Show borrow confirmation modal"""
+    render_borrow_flow(book)
+
+
+def confirm_borrow(book):
+    """Confirm-button callback: borrow, then rerun only the card fragment."""
+    error = borrow_book(book)
+    st.session_state['borrow_result'] = {
+        'key': book_key(book),
+        'title': book['title'],
+        'error': error,
+        'due_date': st.session_state.get('borrow_due_date'),
+    }
+    st.session_state['reopen_card_dialog'] = ('borrow', book_key(book))
+    st.rerun(BOOK_CARDS_FRAGMENT)
+
+
+def render_borrow_flow(book):
+    """Body of the borrow dialog, also shown from the details dialog."""
+    result = st.session_state.get('borrow_result')
+    if result and result['key'] == book_key(book):
+        st.session_state.pop('borrow_result')
+        if result['error']:
+            st.error(result['error'])
+        else:
+            render_borrow_success(result['title'], result['due_date'])
+        return
+
     # Book details in modal
     st.markdown(f"""
         <div style='background: #1e1e1e; padding: 1.5rem; border-radius: 10px; 
@@ -2288,10 +2765,8 @@ def show_borrow_modal(book):
     """, unsafe_allow_html=True)
     
     # Check if user already has this book
-    already_borrowed = [t for t in st.session_state.app.transactions 
-                       if t['user_id'] == st.session_state.user['id'] 
-                       and t['book_id'] == book['id'] 
-                       and t['status'] == 'borrowed']
+    already_borrowed = [t for t in st.session_state.app.transaction_index.active_for_book(book['id'], book_location(book))
+                        if t['user_id'] == st.session_state.user['id']]
     
     if already_borrowed:
         # Show error - already borrowed
@@ -2308,7 +2783,6 @@ def show_borrow_modal(book):
         """)
         
         if st.button("Close", use_container_width=True):
-            st.session_state[f"show_borrow_{book['id']}"] = False
             st.rerun()
     
     # Availability status
@@ -2324,16 +2798,15 @@ def show_borrow_modal(book):
         
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("✅ Confirm Borrow", use_container_width=True, type="primary"):
-                success = borrow_book(book)
-                st.session_state[f"show_borrow_{book['id']}"] = False
-                if success:
-                    st.session_state['show_borrow_success'] = True
-                    st.session_state['borrowed_book_title'] = book['title']
-                st.rerun()
+            st.button(
+                "✅ Confirm Borrow",
+                use_container_width=True,
+                type="primary",
+                on_click=confirm_borrow,
+                args=(book,),
+            )
         with col2:
             if st.button("❌ Cancel", use_container_width=True):
-                st.session_state[f"show_borrow_{book['id']}"] = False
                 st.rerun()
     else:
         st.error("❌ **Not Available** - All copies are currently borrowed")
@@ -2347,8 +2820,10 @@ def show_borrow_modal(book):
                 "We'll notify you when it becomes available."
             )
             st.caption(f"Reservation ID: {existing_reservation.get('id')}")
+            delivery = st.session_state.app.outbox.status(existing_reservation['id'])
+            if delivery is not None:
+                st.caption(f"📧 Confirmation email: {email_delivery_label(delivery)}")
             if st.button("Close", use_container_width=True):
-                st.session_state[f"show_borrow_{book['id']}"] = False
                 st.rerun()
             return
 
@@ -2358,11 +2833,11 @@ def show_borrow_modal(book):
         if not default_email or default_email.lower() == 'not provided':
             default_email = ''
 
-        email_state_key = f"reserve_email_{book['id']}"
+        email_state_key = f"reserve_email_{book_key(book)}"
         if email_state_key not in st.session_state:
             st.session_state[email_state_key] = default_email
 
-        form_key = f"reserve_form_{book['id']}"
+        form_key = f"reserve_form_{book_key(book)}"
         with st.form(form_key):
             email_value = st.text_input(
                 "Email address for reservation updates",
@@ -2383,27 +2858,23 @@ def show_borrow_modal(book):
                 st.session_state.app.update_user_email(current_user['id'], st.session_state.role, clean_email)
 
                 reservation = st.session_state.app.create_reservation(current_user, book)
-
-                email_status = 'sent'
-                email_error = None
-                sent, error = send_reservation_email(clean_email, current_user['name'], book, reservation)
-                if not sent:
-                    email_status = 'failed'
-                    email_error = error
+                message = build_reservation_email(clean_email, current_user['name'], book, reservation)
+                email_error = smtp_config_error(message)
+                if email_error is None:
+                    # Queued, not sent: a slow mail server must not hold up this page.
+                    st.session_state.app.outbox.enqueue(message, reservation['id'])
 
                 st.session_state['reserve_confirmation'] = {
                     'book_title': reservation.get('book_title'),
                     'reservation_id': reservation.get('id'),
                     'email': clean_email,
-                    'email_status': email_status,
+                    'email_status': 'queued' if email_error is None else 'unconfigured',
                     'email_error': email_error,
                 }
 
-                st.session_state[f"show_borrow_{book['id']}"] = False
                 st.rerun()
 
         if st.button("Close", use_container_width=True):
-            st.session_state[f"show_borrow_{book['id']}"] = False
             st.rerun()
 
 @st.dialog("👥 Who Has This Book?")
@@ -2418,8 +2889,7 @@ def show_who_has_modal(book):
     """, unsafe_allow_html=True)
     
     # Get borrowers
-    borrowers = [t for t in st.session_state.app.transactions 
-                 if t['book_id'] == book['id'] and t['status'] == 'borrowed']
+    borrowers = st.session_state.app.transaction_index.active_for_book(book['id'], book_location(book))
     
     if borrowers:
         st.markdown(f"**📊 Currently Borrowed:** {len(borrowers)} of {book['copies']} copies")
@@ -2427,12 +2897,7 @@ def show_who_has_modal(book):
         
         for trans in borrowers:
             # Find user details
-            user_details = None
-            for role in ['students', 'teachers']:
-                user_details = next((u for u in st.session_state.app.users.get(role, []) 
-                                   if u['id'] == trans['user_id']), None)
-                if user_details:
-                    break
+            user_details = st.session_state.app.user_directory.by_id(trans['user_id'])
             
             if user_details:
                 st.markdown(f"""
@@ -2452,12 +2917,16 @@ def show_who_has_modal(book):
         st.info("✅ All copies are available - No one has borrowed this book yet!")
     
     if st.button("Close", use_container_width=True):
-        st.session_state[f"show_who_{book['id']}"] = False
         st.rerun()
 
 @st.dialog("ℹ️ Book Details")
 def show_details_modal(book):
     """Show complete book details"""
+    if st.session_state.get(f"details_borrow_{book_key(book)}"):
+        # "Borrow This Book" swaps the dialog body; one dialog can't open another.
+        render_borrow_flow(book)
+        return
+
     # Book cover placeholder
     st.markdown("""
         <div style='background: linear-gradient(135deg, #6C0345 0%, #DC143C 100%); 
@@ -2496,71 +2965,87 @@ def show_details_modal(book):
     - Maximum renewals: 2 times
     """)
     
+    def switch_to_borrow():
+        st.session_state[f"details_borrow_{book_key(book)}"] = True
+
     col1, col2 = st.columns(2)
     with col1:
         if book['available'] > 0:
-            if st.button("📥 Borrow This Book", use_container_width=True, type="primary"):
-                st.session_state[f"show_details_{book['id']}"] = False
-                st.session_state[f"show_borrow_{book['id']}"] = True
-                st.rerun()
+            st.button("📥 Borrow This Book", use_container_width=True, type="primary", on_click=switch_to_borrow)
     with col2:
         if st.button("Close", use_container_width=True):
-            st.session_state[f"show_details_{book['id']}"] = False
             st.rerun()
 
-def borrow_book(book):
-    """Borrow a book"""
-    if book['available'] <= 0:
-        st.error(f"❌ '{book['title']}' is not available!")
-        return False
-    
-    # Check if user already has this book
-    active_borrows = [t for t in st.session_state.app.transactions 
-                     if t['user_id'] == st.session_state.user['id'] 
-                     and t['book_id'] == book['id'] 
-                     and t['status'] == 'borrowed']
-    
-    if active_borrows:
-        # Show detailed error with due date
-        trans = active_borrows[0]
-        st.error(f"""
-        ❌ **Cannot Borrow - Already Borrowed!**
-        
-        You already have this book:
-        - 📚 **Book:** {book['title']}
-        - 📅 **Borrowed on:** {trans['borrow_date']}
-        - ⏰ **Due date:** {trans['due_date']}
-        
-        💡 **Tip:** Please return this book before borrowing it again!
-        """)
-        return False
-    
-    # Create transaction
-    due_date = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
-    transaction = {
-        'id': len(st.session_state.app.transactions) + 1,
-        'user_id': st.session_state.user['id'],
-        'user_name': st.session_state.user['name'],
-        'book_id': book['id'],
-        'book_title': book['title'],
-        'book_programme': book.get('programme'),
-        'borrow_date': datetime.now().strftime('%Y-%m-%d'),
-        'due_date': due_date,
-        'return_date': None,
-        'status': 'borrowed',
-        'fine': 0
-    }
-    
-    st.session_state.app.transactions.append(transaction)
-    book['available'] -= 1
-    st.session_state.app.save_data()
-    st.session_state['borrow_due_date'] = due_date
-    
-    return True
+def borrow_book(book) -> str | None:
+    """Borrow a book; returns an error message, or None on success"""
+    app = st.session_state.app
+    # Sessions share one library, so check-and-update must not interleave.
+    with app.lock:
+        if book['available'] <= 0:
+            return f"❌ '{book['title']}' is not available!"
+
+        # Check if user already has this book
+        active_borrows = [t for t in app.transaction_index.active_for_book(book['id'], book_location(book))
+                          if t['user_id'] == st.session_state.user['id']]
+
+        if active_borrows:
+            # Show detailed error with due date
+            trans = active_borrows[0]
+            return f"""
+            ❌ **Cannot Borrow - Already Borrowed!**
+
+            You already have this book:
+            - 📚 **Book:** {book['title']}
+            - 📅 **Borrowed on:** {trans['borrow_date']}
+            - ⏰ **Due date:** {trans['due_date']}
+
+            💡 **Tip:** Please return this book before borrowing it again!
+            """
+
+        # Create transaction
+        due_date = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
+        transaction = {
+            'id': len(app.transactions) + 1,
+            'user_id': st.session_state.user['id'],
+            'user_name': st.session_state.user['name'],
+            'book_id': book['id'],
+            'book_title': book['title'],
+            'book_programme': book.get('programme'),
+            'book_collection': book.get('collection'),
+            'borrow_date': datetime.now().strftime('%Y-%m-%d'),
+            'due_date': due_date,
+            'return_date': None,
+            'status': 'borrowed',
+            'fine': 0
+        }
+
+        app.transactions.append(transaction)
+        app.transaction_index.add(transaction)
+        app.stats.borrowed()
+        app.transaction_frame.append(transaction)
+        book['available'] -= 1
+        app.touch_book(book)
+        app.record_change({
+            'op': 'borrow',
+            'transaction': transaction,
+            'book_id': book['id'],
+            'programme': book.get('programme'),
+            'collection': book.get('collection'),
+            'available': book['available'],
+        })
+        st.session_state['borrow_due_date'] = due_date
+
+        return None
+
+# (kind, dialog) pairs behind the card action buttons.
+CARD_MODALS = (
+    ('borrow', show_borrow_modal),
+    ('who', show_who_has_modal),
+    ('details', show_details_modal),
+)
 
-@st.dialog("🎉 Success!")
-def show_borrow_celebration():
-    """Show celebration for successful borrow"""
+def render_borrow_success(title: str, due_date: str | None):
+    """Celebration shown inside the borrow dialog once the loan is recorded"""
     st.markdown("""
         <div style='text-align: center; padding: 2rem;'>
             <h1 style='font-size: 4rem; margin: 0;'>🎉</h1>
@@ -2570,21 +3055,19 @@ def show_borrow_celebration():
     """, unsafe_allow_html=True)
     
     st.success(f"""
-    ✅ **{st.session_state.get('borrowed_book_title', 'Book')}** is now yours!
+    ✅ **{title}** is now yours!
     
-    📅 **Due Date:** {st.session_state.get('borrow_due_date', 'N/A')}  
+    📅 **Due Date:** {due_date or 'N/A'}  
     ⏰ **Remember:** Return on time to avoid late fees!
     """)
     
     st.balloons()
     
     if st.button("🎊 Awesome!", use_container_width=True, type="primary"):
-        st.session_state['show_borrow_success'] = False
         st.rerun()
 
-@st.dialog("🎊 Returned Successfully!")
-def show_return_celebration(on_time=True):
-    """Show celebration for successful return"""
+def render_return_success(on_time=True):
+    """Show celebration for successful return, inline on the transactions page"""
     if on_time:
         st.markdown("""
             <div style='text-align: center; padding: 2rem;'>
@@ -2619,21 +3102,17 @@ def show_return_celebration(on_time=True):
         💡 **Next time:** Try to return on time to avoid fees  
         📚 **Keep reading!**
         """)
-    
-    if st.button("👍 Got it!", use_container_width=True, type="primary"):
-        st.session_state['show_return_success'] = False
-        st.rerun()
 
+@st.fragment
 def my_transactions_page():
-    """Display user's transactions"""
-    # Show celebration modal if triggered
-    if st.session_state.get('show_return_success', False):
-        show_return_celebration(st.session_state.get('return_on_time', True))
+    """Display user's transactions; returning a book reruns only this fragment"""
+    returned = st.session_state.pop('return_result', None)
+    if returned is not None:
+        render_return_success(returned['on_time'])
     
     st.markdown("## 📊 My Transactions")
     
-    user_trans = [t for t in st.session_state.app.transactions 
-                  if t['user_id'] == st.session_state.user['id']]
+    user_trans = st.session_state.app.transaction_index.for_user(st.session_state.user['id'])
     
     if not user_trans:
         st.info("📭 No transactions yet!")
@@ -2643,7 +3122,7 @@ def my_transactions_page():
     tab1, tab2 = st.tabs(["📖 Active Borrows", "📜 History"])
     
     with tab1:
-        active = [t for t in user_trans if t['status'] == 'borrowed']
+        active = st.session_state.app.transaction_index.active_for_user(st.session_state.user['id'])
         if active:
             for trans in active:
                 with st.container():
@@ -2659,8 +3138,7 @@ def my_transactions_page():
                             st.error(f"Fine: ₹{trans['fine']}")
                     
                     with col3:
-                        if st.button("↩️ Return", key=f"return_{trans['id']}"):
-                            return_book(trans)
+                        st.button("↩️ Return", key=f"return_{trans['id']}", on_click=return_book, args=(trans,))
                     
                     st.divider()
         else:
@@ -2690,35 +3168,52 @@ def my_transactions_page():
             st.info("No history yet")
 
 def return_book(trans):
-    """Return a book"""
-    trans['status'] = 'returned'
-    trans['return_date'] = datetime.now().strftime('%Y-%m-%d')
-    
-    # Calculate fine
-    due_date = datetime.strptime(trans['due_date'], '%Y-%m-%d')
-    return_date = datetime.now()
-    days_late = (return_date - due_date).days
-    
-    on_time = days_late <= 0
-    
-    if days_late > 0:
-        trans['fine'] = days_late * 10
-    
-    # Update book availability
-    programme = trans.get('book_programme')
-    if programme:
-        book = next((b for b in programme_books(programme) if b['id'] == trans['book_id']), None)
-    else:
-        book = next((b for b in st.session_state.app.books['teacher_books'] if b['id'] == trans['book_id']), None)
-    if book:
-        book['available'] += 1
-    
-    st.session_state.app.save_data()
-    
-    # Trigger celebration modal
-    st.session_state['show_return_success'] = True
-    st.session_state['return_on_time'] = on_time
-    st.rerun()
+    """Return-button callback; the transactions fragment reruns afterwards"""
+    app = st.session_state.app
+    with app.lock:
+        if trans.get('status') != 'borrowed':
+            # Already returned from another session.
+            return
+
+        trans['status'] = 'returned'
+        trans['return_date'] = datetime.now().strftime('%Y-%m-%d')
+        app.transaction_index.mark_returned(trans)
+
+        # Calculate fine
+        due_date = datetime.strptime(trans['due_date'], '%Y-%m-%d')
+        return_date = datetime.now()
+        days_late = (return_date - due_date).days
+
+        on_time = days_late <= 0
+
+        if days_late > 0:
+            trans['fine'] = days_late * 10
+        app.stats.returned(trans['fine'])
+        app.transaction_frame.update(trans)
+
+        # Update book availability
+        book = app.find_book(trans['book_id'], transaction_location(trans))
+        if book:
+            book['available'] += 1
+            app.touch_book(book)
+
+        record = {
+            'op': 'return',
+            'transaction_id': trans['id'],
+            'return_date': trans['return_date'],
+            'fine': trans['fine'],
+            'book_id': trans['book_id'],
+            'programme': trans.get('book_programme'),
+            'collection': trans.get('book_collection'),
+        }
+        if book:
+            # Legacy transactions carry no location; record where the copy went back to.
+            record['programme'] = book.get('programme') if book.get('catalog_type') == 'program' else None
+            record['collection'] = book.get('collection') if book.get('catalog_type') == 'collection' else None
+            record['available'] = book['available']
+        app.record_change(record)
+
+    st.session_state['return_result'] = {'on_time': on_time}
 
 def main():
     """Main application"""
@@ -2726,6 +3221,8 @@ def main():
     # Check if page state exists
     if 'page' not in st.session_state:
         st.session_state.page = 'login'
+
+    write_session_cookie()
     
     # Not logged in
     if not st.session_state.logged_in:
@@ -2770,4 +3267,8 @@ def main():
             my_transactions_page()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Everything this rerun touched is written in a single batch.
+        st.session_state.app.flush()
@@ -0,0 +1,149 @@
+from library_index import BookIndex, LatestBooks, LibraryStats, TransactionIndex, UserDirectory
+
+
+def catalogue():
+    return {
+        'program_books': {
+            'BCA': [
+                {'id': 'CS001', 'title': 'Algorithms', 'title_signature': 'a'},
+                {'id': 'CS002', 'title': 'Networks', 'title_signature': 'b'},
+            ],
+            'MBA': [{'id': 'CS001', 'title': 'Accounting', 'title_signature': 'c'}],
+        },
+        'teacher_books': [{'id': 'T001', 'title': 'Pedagogy'}],
+        'collection_catalog': {'Journals': [{'id': 'J001', 'title': 'Nature'}]},
+    }
+
+
+def users():
+    return {
+        'students': [{'id': 'S1', 'username': 'Amin'}, {'id': 'S2', 'username': 'bea'}],
+        'teachers': [{'id': 'T1', 'username': 'prof'}],
+        'admin': [{'id': 'ADMIN001', 'username': 'admin'}],
+    }
+
+
+def index_state(index: BookIndex):
+    return sorted((location, book['id']) for location, book in index.items())
+
+
+def test_book_index_matches_a_rebuild_after_adds_and_removes():
+    books = catalogue()
+    index = BookIndex()
+    index.rebuild(books)
+
+    added = {'id': 'CS003', 'title': 'Compilers'}
+    books['program_books']['BCA'].append(added)
+    index.add(added, ('program', 'BCA'))
+    books['program_books']['MBA'].pop()
+    assert index.remove('CS001', ('program', 'MBA'))['title'] == 'Accounting'
+    assert index.remove('CS001', ('program', 'MBA')) is None
+
+    fresh = BookIndex()
+    fresh.rebuild(books)
+    assert index_state(index) == index_state(fresh)
+    assert len(index) == len(fresh) == 5
+    # The id is unambiguous again once the MBA copy is gone.
+    assert index.get('CS001')['title'] == 'Algorithms'
+    assert index.locations('CS001') == [('program', 'BCA')]
+
+
+def test_ambiguous_ids_resolve_only_with_a_location():
+    index = BookIndex()
+    index.rebuild(catalogue())
+
+    assert index.get('CS001') is None
+    assert index.get('CS001', ('program', 'MBA'))['title'] == 'Accounting'
+    assert 'J001' in index and 'NOPE' not in index
+
+
+def test_latest_books_matches_a_rebuild():
+    books = catalogue()
+    latest = LatestBooks()
+    latest.rebuild(books['program_books'])
+
+    dated = {'id': 'CS004', 'title': 'Databases', 'added_at': '2026-01-02 10:00'}
+    books['program_books']['BCA'].append(dated)
+    latest.add('BCA', dated)
+    removed = books['program_books']['BCA'].pop(0)
+    latest.remove('BCA', removed)
+
+    fresh = LatestBooks()
+    fresh.rebuild(books['program_books'])
+    assert [b['id'] for b in latest.top('BCA', 10)] == [b['id'] for b in fresh.top('BCA', 10)] == ['CS004', 'CS002']
+    assert latest.top('BCA', 0) == []
+
+
+def test_user_directory_follows_adds_and_removes():
+    accounts = users()
+    directory = UserDirectory()
+    directory.rebuild(accounts)
+
+    assert directory.by_username('AMIN', 'students')['id'] == 'S1'
+    assert directory.by_id('ADMIN001') is None
+    assert directory.by_id('ADMIN001', ('admin',))['username'] == 'admin'
+
+    new = {'id': 'S3', 'username': 'Cleo'}
+    directory.add('students', new)
+    directory.remove('students', accounts['students'][0])
+
+    assert directory.username_taken('cleo') and directory.id_taken('S3')
+    assert not directory.username_taken('amin') and not directory.id_taken('S1')
+    # A teacher may share a student's username; removing one leaves the other.
+    directory.add('teachers', {'id': 'T2', 'username': 'cleo'})
+    directory.remove('students', new)
+    assert directory.username_taken('cleo') and not directory.username_taken('cleo', ('students',))
+
+
+def test_transaction_index_tracks_returns():
+    loans = [
+        {'id': 1, 'user_id': 'S1', 'book_id': 'CS001', 'book_programme': 'BCA', 'status': 'borrowed'},
+        {'id': 2, 'user_id': 'S1', 'book_id': 'CS001', 'book_programme': 'MBA', 'status': 'borrowed'},
+        {'id': 3, 'user_id': 'S2', 'book_id': 'T001', 'status': 'returned'},
+    ]
+    index = TransactionIndex()
+    index.rebuild(loans)
+
+    assert [t['id'] for t in index.active_for_book('CS001', ('program', 'BCA'))] == [1]
+    loans[0]['status'] = 'returned'
+    index.mark_returned(loans[0])
+
+    fresh = TransactionIndex()
+    fresh.rebuild(loans)
+    assert [t['id'] for t in index.active_for_user('S1')] == [t['id'] for t in fresh.active_for_user('S1')] == [2]
+    assert index.active_count() == fresh.active_count() == 1
+    assert [t['id'] for t in index.for_user('S1')] == [1, 2]
+
+
+def test_library_stats_events_agree_with_a_recount():
+    accounts, books, loans = users(), catalogue(), []
+    stats = LibraryStats()
+    assert stats.recount(accounts, books, loans) == {}
+
+    accounts['students'].append({'id': 'S3', 'username': 'cleo'})
+    stats.user_added('students')
+    books['collection_catalog']['Journals'].append({'id': 'J002'})
+    stats.book_added(('collection', 'Journals'))
+    books['program_books']['BCA'].pop()
+    stats.book_removed(('program', 'BCA'))
+    loans.append({'id': 1, 'status': 'borrowed', 'fine': 0})
+    stats.borrowed()
+    loans[0].update(status='returned', fine=30)
+    stats.returned(30)
+
+    assert stats.recount(accounts, books, loans) == {}
+    assert stats.total_titles == 5
+    assert stats.fines == 30
+
+
+def test_library_stats_recount_reports_drift():
+    accounts, books = users(), catalogue()
+    stats = LibraryStats()
+    stats.recount(accounts, books, [])
+
+    # A change made without reporting its event.
+    accounts['teachers'].append({'id': 'T2', 'username': 'new'})
+    books['teacher_books'].clear()
+
+    assert stats.recount(accounts, books, []) == {'users.teachers': (1, 2), 'titles.teacher': (1, 0)}
+    assert stats.users['teachers'] == 2
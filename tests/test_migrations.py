@@ -0,0 +1,117 @@
+import json
+import os
+
+import pytest
+
+from security_utils import verify_user_password
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    # Importing the script builds the shared library in the working directory.
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('import'))
+    try:
+        import streamlit_app
+    finally:
+        os.chdir(cwd)
+    return streamlit_app
+
+
+@pytest.fixture
+def open_app(app_module, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('BOOKFLOW_STORAGE', raising=False)
+    opened = []
+
+    def open_app():
+        app = app_module.BookFlowApp()
+        opened.append(app)
+        return app
+
+    yield open_app
+    for app in opened:
+        app.flush()
+        app.outbox.close()
+
+
+def legacy_data():
+    """A data file from before schema_version existed."""
+    return {
+        'users': {
+            'students': [{'id': 'S1', 'username': 'amin', 'password': 'pass123', 'name': 'Amin'}],
+            'teachers': [{'id': 'T1', 'username': 'prof', 'password': 'teach123', 'name': 'Prof'}],
+            'admin': [{'id': 'ADMIN001', 'username': 'admin', 'password': 'admin123', 'name': 'Admin'}],
+        },
+        'books': {
+            'student_books': [{'id': 'B001', 'title': 'Pride & Prejudice', 'author': 'Jane Austen', 'available': 2}],
+            'teacher_books': [{'id': 'T001', 'title': 'Pedagogy', 'author': 'Various', 'copies': 1, 'available': 1}],
+        },
+        'transactions': [],
+    }
+
+
+def read_data(path='bookflow_data.json'):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_v0_file_is_upgraded_to_the_current_version(open_app, app_module):
+    with open('bookflow_data.json', 'w') as f:
+        json.dump(legacy_data(), f)
+
+    app = open_app()
+
+    migrations = app_module.BookFlowApp.MIGRATIONS
+    assert [name for name, _ in app.migration_timings] == [name for _, name in migrations]
+    assert app.meta['schema_version'] == migrations[-1][0]
+    for role_key, users in app.users.items():
+        for user in users:
+            assert 'password' not in user
+            assert user['contact'] == user['email'] == 'Not provided'
+    assert verify_user_password(app.users['students'][0], 'pass123')
+    assert app.users['students'][0]['programme'] in app_module.all_programmes()
+    assert 'student_books' not in app.books
+    general = app.books['program_books']['General Library']
+    legacy = next(book for book in general if book['title'] == 'Pride & Prejudice')
+    assert (legacy['copies'], legacy['available'], legacy['catalog_type']) == (2, 2, 'program')
+    app.flush()
+
+    # The upgrade is on disk: a second load runs nothing and sees the same data.
+    stored = read_data()
+    assert stored['meta']['schema_version'] == migrations[-1][0]
+    again = open_app()
+    assert again.migration_timings == []
+    assert again.users == app.users
+    assert again.books == app.books
+
+
+def test_only_changed_seed_templates_are_reseeded(open_app, app_module, monkeypatch):
+    first = open_app()
+    first.flush()
+    fingerprints = first.meta['seed_fingerprints']
+    programme = next(iter(fingerprints['programmes']))
+
+    data = read_data()
+    data['meta']['seed_fingerprints']['catalog'] = 'stale'
+    data['meta']['seed_fingerprints']['programmes'][programme] = 'stale'
+    with open('bookflow_data.json', 'w') as f:
+        json.dump(data, f)
+
+    calls = []
+
+    def spy(kind, seed):
+        def wrapper(self, names=None):
+            calls.append((kind, names))
+            return seed(self, names)
+        return wrapper
+
+    cls = app_module.BookFlowApp
+    monkeypatch.setattr(cls, 'seed_program_books', spy('programmes', cls.seed_program_books))
+    monkeypatch.setattr(cls, 'seed_collection_catalog', spy('collections', cls.seed_collection_catalog))
+
+    app = open_app()
+
+    assert calls == [('programmes', [programme])]
+    assert app.meta['seed_fingerprints'] == fingerprints
+    assert app.books == first.books
@@ -0,0 +1,110 @@
+from email.message import EmailMessage
+
+import pytest
+
+import outbox
+from outbox import EmailOutbox, LocalSMTPServer, smtp_config_error
+
+
+def reservation_email(to="student@example.com"):
+    message = EmailMessage()
+    message["From"] = "library@example.com"
+    message["To"] = to
+    message["Subject"] = "Reservation confirmed"
+    message.set_content("Your book is on hold.")
+    return message
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = LocalSMTPServer().start()
+    monkeypatch.setenv("BOOKFLOW_SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setenv("BOOKFLOW_SMTP_PORT", str(server.port))
+    monkeypatch.setenv("BOOKFLOW_SMTP_USERNAME", "library")
+    monkeypatch.setenv("BOOKFLOW_SMTP_PASSWORD", "secret")
+    monkeypatch.setenv("BOOKFLOW_SMTP_SECURITY", "none")
+    yield server
+    server.stop()
+
+
+def test_queued_message_is_delivered_over_smtp(tmp_path, smtp_server):
+    box = EmailOutbox(str(tmp_path / "outbox.db"))
+    try:
+        box.enqueue(reservation_email(), reference="RES001")
+        assert box.status("RES001")["status"] == "queued"
+
+        assert box.deliver_due() == 1
+        status = box.status("RES001")
+    finally:
+        box.close()
+
+    assert status["status"] == "sent"
+    assert status["attempts"] == 1
+    assert status["last_error"] is None
+    [received] = smtp_server.messages
+    assert received["to"] == ["<student@example.com>"]
+    assert received["message"]["Subject"] == "Reservation confirmed"
+    assert "on hold" in received["message"].get_content()
+
+
+def test_failed_message_backs_off_then_becomes_a_dead_letter(tmp_path, monkeypatch):
+    clock = [1_000.0]
+    monkeypatch.setattr(outbox.time, "time", lambda: clock[0])
+    attempts = []
+
+    def failing_sender(message):
+        attempts.append(message["To"])
+        return False, "mailbox unavailable"
+
+    box = EmailOutbox(str(tmp_path / "outbox.db"), sender=failing_sender, max_attempts=3, backoff=10)
+    try:
+        message_id = box.enqueue(reservation_email(), reference="RES002")
+
+        assert box.deliver_due() == 1
+        assert box.status("RES002")["next_attempt_at"] == 1_010.0
+        # Not due yet: nothing is retried before the backoff expires.
+        clock[0] = 1_009.0
+        assert box.deliver_due() == 0
+
+        clock[0] = 1_010.0
+        assert box.deliver_due() == 1
+        status = box.status("RES002")
+        assert (status["status"], status["attempts"]) == ("queued", 2)
+        assert status["next_attempt_at"] == 1_030.0
+
+        clock[0] = 1_030.0
+        assert box.deliver_due() == 1
+        status = box.status("RES002")
+        assert (status["status"], status["attempts"]) == ("dead", 3)
+        assert status["last_error"] == "mailbox unavailable"
+        [dead] = box.dead_letters()
+        assert (dead["id"], dead["reference"], dead["attempts"]) == (message_id, "RES002", 3)
+
+        clock[0] = 5_000.0
+        assert box.deliver_due() == 0
+        box.retry_dead(message_id)
+        assert box.dead_letters() == []
+        assert box.deliver_due() == 1
+        assert box.status("RES002")["attempts"] == 1
+    finally:
+        box.close()
+
+    assert len(attempts) == 4
+
+
+def test_unconfigured_smtp_dead_letters_on_the_first_attempt(tmp_path, monkeypatch):
+    for name in ("SERVER", "PORT", "USERNAME", "PASSWORD", "SECURITY"):
+        monkeypatch.delenv(f"BOOKFLOW_SMTP_{name}", raising=False)
+    monkeypatch.delenv("BOOKFLOW_EMAIL_SENDER", raising=False)
+    assert "incomplete" in smtp_config_error()
+
+    box = EmailOutbox(str(tmp_path / "outbox.db"))
+    try:
+        box.enqueue(reservation_email(), reference="RES003")
+        assert box.deliver_due() == 1
+        status = box.status("RES003")
+    finally:
+        box.close()
+
+    assert (status["status"], status["attempts"]) == ("dead", 1)
+    assert "SMTP settings are incomplete" in status["last_error"]
@@ -0,0 +1,59 @@
+import threading
+
+from search import SearchIndex, TrigramIndex, UserSearchIndex
+
+
+def book(book_id, title):
+    return {'id': book_id, 'title': title, 'author': 'Ada Writer', 'program_category': 'Science'}
+
+
+def test_searches_survive_concurrent_catalogue_edits():
+    index = SearchIndex()
+    index.rebuild(('program', 'BCA', book(f'B{i}', f'algorithms volume {i}')) for i in range(200))
+    fuzzy = TrigramIndex()
+    fuzzy.rebuild(('program', 'BCA', book(f'B{i}', f'algorithms volume {i}')) for i in range(200))
+    users = UserSearchIndex()
+    users.rebuild({'students': [{'id': f'S{i}', 'name': f'student {i}'} for i in range(200)]})
+    stop = threading.Event()
+    errors = []
+
+    def churn():
+        i = 0
+        while not stop.is_set():
+            location = ('program', 'BCA')
+            index.add(book(f'N{i}', f'algorithmic novelty{i}'), location)
+            index.remove(f'N{i}', location)
+            fuzzy.add(book(f'N{i}', f'algorithmic novelty{i}'), location)
+            fuzzy.remove(f'N{i}', location)
+            users.add('students', {'id': f'N{i}', 'name': f'stunt{i}'})
+            users.remove('students', f'N{i}')
+            i += 1
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    try:
+        for _ in range(300):
+            try:
+                index.search('algo')
+                index.facet_counts()
+                index.facet_counts(index.search_keys('a'))
+                fuzzy.search('algoritms', budget=1.0)
+                users.search_keys('stu')
+            except RuntimeError as exc:
+                errors.append(exc)
+                break
+    finally:
+        stop.set()
+        writer.join()
+
+    assert errors == []
+    assert len(index.search('algorithms')) == 200
+
+
+def test_fuzzy_ranking_prefers_books_matching_more_terms():
+    fuzzy = TrigramIndex()
+    location = ('program', 'BCA')
+    fuzzy.add({'id': 'B1', 'title': 'Databases', 'author': 'Codd'}, location)
+    fuzzy.add({'id': 'B2', 'title': 'Distributed Databases', 'author': 'Lamport'}, location)
+
+    assert [b['id'] for b in fuzzy.search('distribted databses', budget=1.0)] == ['B2', 'B1']
@@ -0,0 +1,106 @@
+import sys
+import types
+
+import security_utils
+from security_utils import HashingExecutor, generate_salt
+
+
+def test_pool_workers_do_not_import_the_main_script(tmp_path, monkeypatch):
+    # Mimic Streamlit: __main__ is a module whose __file__ is the app script.
+    marker = tmp_path / "imported"
+    script = tmp_path / "streamlit_app.py"
+    script.write_text(f"open({str(marker)!r}, 'w').write(__name__)\n")
+    fake_main = types.ModuleType("__main__")
+    fake_main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, "__main__", fake_main)
+
+    executor = HashingExecutor(workers=2, max_pending=4)
+    try:
+        salt = generate_salt()
+        futures = [executor.submit("secret", salt, iterations=1_000) for _ in range(4)]
+        hashes = {future.result(timeout=60) for future in futures}
+        stats = executor.stats()
+    finally:
+        executor.shutdown()
+
+    assert hashes == {security_utils._pbkdf2("secret", salt, iterations=1_000)}
+    assert stats["inline"] == 0
+    assert not marker.exists(), f"streamlit_app was imported in a worker as {marker.read_text()}"
+    assert sys.modules["__main__"] is fake_main
+
+
+def test_stored_calibration_is_reused(monkeypatch):
+    monkeypatch.setattr(security_utils, "PBKDF2_ITERATIONS", None)
+    monkeypatch.setattr(security_utils, "PBKDF2_TARGET_MS", "50")
+    monkeypatch.setattr(security_utils, "_policy", None)
+    monkeypatch.setattr(security_utils, "calibrate_iterations", lambda target_ms: 400_000)
+
+    calibration = security_utils.load_password_policy(None)
+    assert calibration == {"algorithm": "sha256", "target_ms": 50.0, "iterations": 400_000}
+
+    # A later run with the same target keeps the stored count instead of recalibrating.
+    monkeypatch.setattr(security_utils, "calibrate_iterations", lambda target_ms: 370_000)
+    assert security_utils.load_password_policy(calibration) is calibration
+    assert security_utils.password_policy() == ("sha256", 400_000)
+
+
+def test_needs_rehash_only_for_weaker_hashes(monkeypatch):
+    monkeypatch.setattr(security_utils, "_policy", ("sha256", 300_000))
+
+    def record(algorithm, iterations):
+        return {"password_algorithm": algorithm, "password_iterations": iterations}
+
+    assert security_utils.needs_rehash(record("pbkdf2_sha256", 260_000))
+    assert not security_utils.needs_rehash(record("pbkdf2_sha256", 300_000))
+    assert not security_utils.needs_rehash(record("pbkdf2_sha256", 520_000))
+    assert security_utils.needs_rehash(record("pbkdf2_sha512", 520_000))
+    # Legacy records are 260k SHA-256: weaker than this policy, but not than a lower one.
+    assert security_utils.needs_rehash({"password_hash": "x", "password_salt": "y"})
+    monkeypatch.setattr(security_utils, "_policy", ("sha256", 100_000))
+    assert not security_utils.needs_rehash({"password_hash": "x", "password_salt": "y"})
+
+
+class FailingPool:
+    """Stands in for ProcessPoolExecutor; every submission fails."""
+
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        FailingPool.created += 1
+
+    def submit(self, *args):
+        raise ValueError("worker pipe closed")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def test_pool_failures_release_slots_and_rebuild_the_pool(monkeypatch):
+    monkeypatch.setattr(security_utils, "ProcessPoolExecutor", FailingPool)
+    FailingPool.created = 0
+    executor = HashingExecutor(workers=2, max_pending=2, max_failures=3)
+    salt = generate_salt()
+
+    # More submissions than slots: a leaked slot would block here for good.
+    hashes = {executor.submit("secret", salt, iterations=1_000).result() for _ in range(5)}
+
+    assert hashes == {security_utils._pbkdf2("secret", salt, iterations=1_000)}
+    assert FailingPool.created == 3
+    stats = executor.stats()
+    assert (stats["queue_depth"], stats["inline"], stats["pool_failures"], stats["workers"]) == (0, 5, 3, 0)
+
+
+def test_slot_is_released_when_submit_raises(monkeypatch):
+    executor = HashingExecutor(workers=0, max_pending=1)
+
+    def boom(*args):
+        raise MemoryError
+
+    monkeypatch.setattr(executor, "_get_pool", boom)
+    for _ in range(2):
+        try:
+            executor.submit("secret", generate_salt(), iterations=1_000)
+        except MemoryError:
+            pass
+    assert executor.queue_depth == 0
+    assert executor._slots.acquire(blocking=False)
@@ -0,0 +1,22 @@
+from session_tokens import SessionTokens
+
+
+def test_token_only_validates_with_its_binding():
+    tokens = SessionTokens()
+    token = tokens.issue("students", "STU001", "Firefox/128")
+
+    assert tokens.validate(token, "Firefox/128") == ("students", "STU001")
+    assert tokens.validate(token, "curl/8.5") is None
+    assert tokens.validate(token) is None
+
+
+def test_revoked_and_expired_tokens_are_rejected():
+    tokens = SessionTokens()
+    token = tokens.issue("admin", "ADMIN001", "ua")
+    tokens.revoke(token)
+    assert tokens.validate(token, "ua") is None
+
+    expired = SessionTokens(ttl=-1)
+    stale = expired.issue("admin", "ADMIN001", "ua")
+    assert expired.validate(stale, "ua") is None
+    assert len(expired) == 0
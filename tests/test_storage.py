@@ -0,0 +1,109 @@
+import json
+
+from storage import JsonFileStorage, SQLiteStorage, TransactionJournal, apply_record, migrate_json_to_sqlite
+
+
+def borrow(tx_id, available):
+    return {
+        'op': 'borrow',
+        'book_id': 'B001',
+        'available': available,
+        'transaction': {'id': tx_id, 'book_id': 'B001', 'status': 'borrowed'},
+    }
+
+
+def test_replay_skips_a_torn_tail_and_later_appends_survive(tmp_path):
+    data_file = tmp_path / 'bookflow_data.json'
+    data_file.write_text(json.dumps({
+        'books': {'teacher_books': [{'id': 'B001', 'available': 3}]},
+        'transactions': [],
+    }))
+    storage = JsonFileStorage(str(data_file))
+    storage.journal.append(borrow(1, 2))
+    # Crash halfway through writing the second record.
+    line = json.dumps(borrow(2, 1))
+    with open(storage.journal.path, 'a', encoding='utf-8') as f:
+        f.write(line[: len(line) // 2])
+
+    data = storage.load()
+    assert [t['id'] for t in data['transactions']] == [1]
+
+    storage.journal.append(borrow(3, 1))
+    storage.journal.append(borrow(4, 0))
+    data = JsonFileStorage(str(data_file)).load()
+
+    assert [t['id'] for t in data['transactions']] == [1, 3, 4]
+    assert data['books']['teacher_books'][0]['available'] == 0
+
+
+def test_replay_cuts_an_unterminated_record(tmp_path):
+    journal = TransactionJournal(str(tmp_path / 'j.journal'))
+    journal.append({'op': 'a'})
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"op":"b"}')
+
+    assert list(journal.replay()) == [{'op': 'a'}]
+    journal.append({'op': 'c'})
+    assert list(journal.replay()) == [{'op': 'a'}, {'op': 'c'}]
+
+
+def library_data():
+    return {
+        'users': {
+            'students': [{'id': 'S1', 'username': 'amin', 'name': 'Amin', 'programme': 'BCA'}],
+            'teachers': [{'id': 'T1', 'username': 'prof', 'name': 'Prof'}],
+            'admin': [{'id': 'ADMIN001', 'username': 'admin', 'name': 'Admin'}],
+        },
+        'books': {
+            'program_books': {
+                'BCA': [{'id': 'CS001', 'title': 'Algorithms', 'copies': 2, 'available': 2, 'programme': 'BCA'}],
+                'MBA': [{'id': 'CS001', 'title': 'Accounting', 'copies': 1, 'available': 1, 'programme': 'MBA'}],
+            },
+            'teacher_books': [{'id': 'T001', 'title': 'Pedagogy', 'copies': 1, 'available': 0}],
+            'collection_catalog': {'Journals': [{'id': 'J001', 'title': 'Nature', 'copies': 0, 'available': 0}]},
+        },
+        'transactions': [
+            {'id': 1, 'user_id': 'T1', 'book_id': 'T001', 'status': 'borrowed', 'fine': 0},
+        ],
+        'reservations': [{'id': 'RSV1', 'user_id': 'S1', 'book_id': 'T001', 'status': 'active'}],
+        'meta': {'schema_version': 7, 'seed_fingerprints': {'catalog': 'abc'}},
+    }
+
+
+def test_migrator_round_trips_json_into_sqlite(tmp_path):
+    json_path = tmp_path / 'bookflow_data.json'
+    json_path.write_text(json.dumps(library_data()))
+    source = JsonFileStorage(str(json_path))
+    # Journaled changes not yet folded into the snapshot must be migrated too.
+    source.journal.append({
+        'op': 'borrow', 'book_id': 'CS001', 'programme': 'MBA', 'available': 0,
+        'transaction': {'id': 2, 'user_id': 'S1', 'book_id': 'CS001', 'book_programme': 'MBA', 'status': 'borrowed'},
+    })
+    expected = source.load()
+
+    counts = migrate_json_to_sqlite(str(json_path), str(tmp_path / 'bookflow_data.db'))
+
+    assert counts == {'users': 3, 'books': 4, 'transactions': 2, 'reservations': 1}
+    target = SQLiteStorage(str(tmp_path / 'bookflow_data.db'))
+    try:
+        assert target.load() == expected
+    finally:
+        target.close()
+
+
+def test_sqlite_records_match_applying_them_in_memory(tmp_path):
+    data = library_data()
+    storage = SQLiteStorage(str(tmp_path / 'bookflow_data.db'))
+    try:
+        storage.save(data)
+        records = [
+            {'op': 'return', 'book_id': 'T001', 'available': 1, 'transaction_id': 1, 'return_date': '2026-01-05', 'fine': 20},
+            {'op': 'email', 'role': 'students', 'user_id': 'S1', 'email': 'amin@example.com'},
+        ]
+        for record in records:
+            apply_record(data, record)
+            storage.record(record, data)
+
+        assert storage.load() == data
+    finally:
+        storage.close()
@@ -0,0 +1,60 @@
+import pandas as pd
+
+from library_index import BookIndex
+from transaction_browser import TransactionFrame
+
+
+def catalogue():
+    return {
+        'program_books': {'General Library': [{'id': 'B001', 'title': 'Pride & Prejudice'}]},
+        'teacher_books': [{'id': 'T001', 'title': 'Pedagogy', 'catalog_type': 'teacher'}],
+        'collection_catalog': {},
+    }
+
+
+def test_legacy_rows_take_their_programme_from_the_book_index():
+    index = BookIndex()
+    index.rebuild(catalogue())
+    transactions = [
+        {'id': 1, 'book_id': 'B001', 'status': 'borrowed'},
+        {'id': 2, 'book_id': 'T001', 'status': 'borrowed'},
+        {'id': 3, 'book_id': 'GONE', 'status': 'returned'},
+        {'id': 4, 'book_id': 'X', 'book_programme': 'BCA', 'status': 'borrowed'},
+    ]
+
+    frame = TransactionFrame(transactions, index).frame()
+
+    assert list(frame['programme']) == ['General Library', 'Teacher Books', 'Unknown', 'BCA']
+
+
+def loan(tx_id, book_id, borrowed, status='borrowed', **extra):
+    return {
+        'id': tx_id, 'user_id': 'S1', 'user_name': 'Amin', 'book_id': book_id, 'book_title': book_id,
+        'borrow_date': borrowed, 'due_date': '2026-03-01', 'return_date': None, 'status': status, 'fine': 0,
+        **extra,
+    }
+
+
+def test_patched_frame_matches_a_fresh_build():
+    index = BookIndex()
+    index.rebuild(catalogue())
+    log = [loan(1, 'B001', '2026-01-01'), loan(2, 'T001', '2026-01-02')]
+    browser = TransactionFrame(log, index)
+    assert len(browser.frame()) == 2
+
+    # The app appends to the shared log and reports each change to the frame.
+    log.append(loan(3, 'X', '2026-01-03', book_programme='BCA'))
+    browser.append(log[-1])
+    log[0].update(status='returned', return_date='2026-01-10', fine=40)
+    browser.update(log[0])
+    # A change to a loan still waiting in the buffer is picked up when it is flushed.
+    log[2].update(status='returned', return_date='2026-01-11')
+    browser.update(log[2])
+    log.append(loan(4, 'B001', '2026-01-04'))
+    browser.append(log[-1])
+
+    patched = browser.frame()
+    fresh = TransactionFrame(log, index).frame()
+    pd.testing.assert_frame_equal(patched, fresh)
+    page, total = browser.query(page=0, page_size=2, status='returned', sort_by='fine')
+    assert total == 2 and list(page['id']) == [1, 3]